@@ -1,27 +1,48 @@
 import time
+import asyncio
 import datetime
 import os
 import threading
 import sys
 import configparser
-import streamlink
-import subprocess
-import queue
-import requests
+import shutil
+import signal
+import socket
 from proxyManager import ProxyManager
+from sessionPool import SessionPool, DIRECT, route_key
+from recorderPool import RecorderPool, AsyncHLSStream
+from routeCache import RouteCache, GeoBlocked
+from bandwidthBudget import BandwidthBudget
+from onlineProber import OnlineProber, BASE_URL, API_URL
+from hlsPrefetcher import HLSPrefetcher, parse_master_playlist
+from streamlink.stream.hls import HLSStream
+from ffmpegRemuxer import FFmpegRemuxer
+from diskWriter import WriteBudget, DiskGuard, RecordingWriter, repair_recordings
+from logWriter import log, writer
+from metricsServer import MetricsServer
+from postProcessing import JobScheduler
+from probeScheduler import ProbeScheduler
+from workerCluster import ClusterMember, Coordinator
+from modelRegistry import ModelRegistry, IDLE, PROBING, RECORDING, POSTPROCESSING
 
 if os.name == 'nt':
     import ctypes
     kernel32 = ctypes.windll.kernel32
     kernel32.SetConsoleMode(kernel32.GetStdHandle(-11), 7)
 
+def argValue(name, default=None):
+    if name in sys.argv[:-1]:
+        return sys.argv[sys.argv.index(name) + 1]
+    return default
+
 mainDir = sys.path[0]
+configFile = argValue('--config', mainDir + '/config.conf')
 Config = configparser.ConfigParser()
 setting = {}
 
-recording = []
+registry = ModelRegistry()
 
-hilos = []
+SHUTDOWN_TIMEOUT = 30
 
 proxy_manager = ProxyManager()
 
@@ -31,219 +52,500 @@ def cls():
 def readConfig():
     global setting
 
-    Config.read(mainDir + '/config.conf')
+    Config.read(configFile)
     setting = {
         'save_directory': Config.get('paths', 'save_directory'),
+        'directory_structure': Config.get('paths', 'directory_structure', fallback='{path}/{model}/{year}.{month}.{day}_{hour}.{minutes}.{seconds}_{model}.mp4').strip(),
+        'completed_directory': Config.get('paths', 'completed_directory', fallback='').strip(),
         'wishlist': Config.get('paths', 'wishlist'),
+        'siteUrl': Config.get('settings', 'siteUrl', fallback=BASE_URL).rstrip('/'),
         'interval': int(Config.get('settings', 'checkInterval')),
+        'maxCheckInterval': Config.getint('settings', 'maxCheckInterval', fallback=600),
+        'probeRate': Config.getfloat('settings', 'probeRate', fallback=10),
+        'probeJitter': Config.getfloat('settings', 'probeJitter', fallback=0.2),
+        'probeHistoryFile': Config.get('settings', 'probeHistoryFile', fallback='probe_history.json'),
         'postProcessingCommand': Config.get('settings', 'postProcessingCommand'),
+        'probeConcurrency': Config.getint('settings', 'probeConcurrency', fallback=100),
+        'presenceMode': Config.get('settings', 'presenceMode', fallback='api').strip().lower(),
+        'proxyCacheFile': Config.get('settings', 'proxyCacheFile', fallback='proxy_cache.json'),
+        'fetchProxyLists': Config.getboolean('settings', 'fetchProxyLists', fallback=True),
+        'proxyTestModel': Config.get('settings', 'proxyTestModel', fallback='').strip() or 'test',
+        'chunkSize': Config.getint('settings', 'chunkSize', fallback=256) * 1024,
+        'unlinkCheckInterval': Config.getfloat('settings', 'unlinkCheckInterval', fallback=5),
+        'recorderMode': Config.get('settings', 'recorderMode', fallback='streamlink').strip().lower(),
+        'segmentWorkers': Config.getint('settings', 'segmentWorkers', fallback=4),
+        'recorderLoops': Config.getint('settings', 'recorderLoops', fallback=2),
+        'diskThreads': Config.getint('settings', 'diskThreads', fallback=4),
+        'resumeThreads': Config.getint('settings', 'resumeThreads', fallback=32),
+        'prefetchDepth': Config.getint('settings', 'prefetchDepth', fallback=6),
+        'liveEdge': Config.getint('settings', 'liveEdge', fallback=3),
+        'stallTimeout': Config.getint('settings', 'stallTimeout', fallback=30),
+        'httpPoolSize': Config.getint('settings', 'httpPoolSize', fallback=32),
+        'sessionRoutes': Config.getint('settings', 'sessionRoutes', fallback=64),
+        'routeCacheTtl': Config.getint('settings', 'routeCacheTtl', fallback=600),
+        'negativeCacheTtl': Config.getint('settings', 'negativeCacheTtl', fallback=15),
+        'resumeTimeout': Config.getint('settings', 'resumeTimeout', fallback=60),
+        'bandwidthBudget': int(float(Config.get('settings', 'bandwidthBudget', fallback='') or 0) * 1000000),
+        'remux': Config.getboolean('settings', 'remux', fallback=False),
+        'ffmpegPath': Config.get('settings', 'ffmpegPath', fallback='ffmpeg'),
+        'writeBuffer': Config.getint('settings', 'writeBufferMB', fallback=256) * 1048576,
+        'preallocate': Config.getint('settings', 'preallocateMB', fallback=64) * 1048576,
+        'rollSize': int(Config.get('settings', 'rollSizeMB', fallback='') or 0) * 1048576,
+        'rollSeconds': int(Config.get('settings', 'rollMinutes', fallback='') or 0) * 60,
+        'minFreeSpace': Config.getint('settings', 'minFreeSpaceMB', fallback=2048) * 1048576,
+        'headless': Config.getboolean('settings', 'headless', fallback=False) or '--headless' in sys.argv,
+        'metricsPort': int(argValue('--metrics-port') or Config.get('settings', 'metricsPort', fallback='') or 0),
+        'metricsHost': Config.get('settings', 'metricsHost', fallback='127.0.0.1'),
+        'postProcessingDb': Config.get('settings', 'postProcessingDb', fallback='postprocessing.db'),
+        'postProcessingTimeout': Config.getint('settings', 'postProcessingTimeout', fallback=3600),
+        'postProcessingRetries': Config.getint('settings', 'postProcessingRetries', fallback=3),
+        'postProcessingPriority': Config.get('settings', 'postProcessingPriority', fallback='age').strip().lower(),
+        'postProcessingKeepDays': Config.getfloat('settings', 'postProcessingKeepDays', fallback=7),
+        'genders': [g.strip() for g in Config.get('settings', 'genders').split(',') if g.strip()],
+        'clusterDirectory': Config.get('settings', 'clusterDirectory', fallback='').strip(),
+        'workerId': argValue('--worker') or Config.get('settings', 'workerId', fallback='').strip(),
+        'leaseTimeout': Config.getint('settings', 'leaseTimeout', fallback=30),
         }
+    if setting['clusterDirectory'] and not setting['workerId']:
+        setting['workerId'] = socket.gethostname()
+    if setting['workerId']:
+        for key in ('postProcessingDb', 'probeHistoryFile'):
+            root, extension = os.path.splitext(setting[key])
+            setting[key] = f'{root}.{setting["workerId"]}{extension}'
     try:
         setting['postProcessingThreads'] = int(Config.get('settings', 'postProcessingThreads'))
     except ValueError:
-        if setting['postProcessingCommand'] and not setting['postProcessingThreads']:
-            setting['postProcessingThreads'] = 1
+        setting['postProcessingThreads'] = 1
     
+    writer.configure(
+        level=Config.get('logging', 'level', fallback='info'),
+        levels=Config.get('logging', 'levels', fallback=''),
+        console=Config.get('logging', 'console', fallback=''),
+        format=Config.get('logging', 'format', fallback='text'),
+        max_size=Config.getfloat('logging', 'maxSize', fallback=10),
+        backups=Config.getint('logging', 'backups', fallback=3),
+        )
+    writer.tag = setting['workerId']
+
     if not os.path.exists(f'{setting["save_directory"]}'):
         os.makedirs(f'{setting["save_directory"]}')
 
-def postProcess():
-    while True:
-        while processingQueue.empty():
-            time.sleep(1)
-        parameters = processingQueue.get()
-        model = parameters['model']
-        path = parameters['path']
-        filename = os.path.split(path)[-1]
-        directory = os.path.dirname(path)
-        file = os.path.splitext(filename)[0]
-        subprocess.call(setting['postProcessingCommand'].split() + [path, filename, directory, model,  file, 'cam4'])
-
 class Modelo(threading.Thread):
-    def __init__(self, modelo):
+    def __init__(self, modelo, hls_source=None):
         threading.Thread.__init__(self)
         self.modelo = modelo
+        self.hls_source = hls_source
         self._stopevent = threading.Event()
         self.file = None
         self.online = None
-        self.lock = threading.Lock()
+        self.bytesWritten = 0
+        self.streamStats = None
+        self.stream = None
+        self.reopen = False
+        self.writer = None
+        self.lastPath = None
+        self.fileIndex = 0
+        self.route = None
+        self.gaps = 0
+        self.throughput = 0.0
+        self.started = time.time()
+        self.ttfb = None
+        self.windowStart = self.started
+        self.windowBytes = 0
 
     def run(self):
-        global recording, hilos
-        isOnline = self.isOnline()
+        isOnline = self.hls_source or self.isOnline()
         if isOnline == False:
             self.online = False
         else:
             self.online = True
-            self.file = os.path.join(setting['save_directory'], self.modelo, f'{datetime.datetime.fromtimestamp(time.time()).strftime("%Y.%m.%d_%H.%M.%S")}_{self.modelo}.mp4')
             try:
-                session = streamlink.Streamlink()
-
-                max_attempts = 3
-                fd = None
-
-                for attempt in range(max_attempts):
-                    try:
-                        with open('model_check.log', 'a') as f:
-                            f.write(f'[{self.modelo}] Recording attempt {attempt+1}\\n')
-
-                        if attempt == 0:
-                            with open('model_check.log', 'a') as f:
-                                f.write(f'[{self.modelo}] Trying direct stream connection...\\n')
-                            streams = session.streams(f'hlsvariant://{isOnline}')
-                        else:
-                            proxy = proxy_manager.get_random_proxy()
-                            if proxy:
-                                proxy_url = proxy.get('https') or proxy.get('http')
-                                with open('model_check.log', 'a') as f:
-                                    f.write(f'[{self.modelo}] Trying with proxy: {proxy_url}\\n')
-                                session.set_option('http-proxy', proxy_url)
-                                streams = session.streams(f'hlsvariant://{isOnline}')
-                            else:
-                                with open('model_check.log', 'a') as f:
-                                    f.write(f'[{self.modelo}] No proxy available for stream\\n')
-                                break
-
-                        stream = streams['best']
-                        fd = stream.open()
-                        with open('model_check.log', 'a') as f:
-                            f.write(f'[{self.modelo}] \u2713 Stream opened successfully!\\n')
-                        break
-                    except Exception as e:
-                        with open('model_check.log', 'a') as f:
-                            f.write(f'[{self.modelo}] Stream attempt {attempt+1} failed: {e}\\n')
-                        if attempt < max_attempts - 1:
-                            time.sleep(2)
-                            continue
-                        else:
-                            raise e
-
+                fd = self.connect(isOnline)
                 if not fd:
                     raise Exception('Failed to open stream after all attempts')
-                if not isModelInListofObjects(self.modelo, recording):
-                    os.makedirs(os.path.join(setting['save_directory'], self.modelo), exist_ok=True)
-                    with open(self.file, 'wb') as f:
-                        self.lock.acquire()
-                        recording.append(self)
-                        for index, hilo in enumerate(hilos):
-                            if hilo.modelo == self.modelo:
-                                del hilos[index]
+                if registry.transition(self.modelo, RECORDING, expected=self):
+                    self.writer = self.newWriter()
+                    self.writer.start()
+                    try:
+                        while True:
+                            reason = self.capture(fd, self.writer)
+                            if reason in ('stopped', 'unlinked') or self.writer.failed():
                                 break
-                        self.lock.release()
-                        while not (self._stopevent.isSet() or os.fstat(f.fileno()).st_nlink == 0):
-                            try:
-                                data = fd.read(1024)
-                                f.write(data)
-                            except:
-                                fd.close()
+                            if reason == 'quality change' and setting['remux']:
+                                self.writer.roll()
+                            fd = self.resume(reason)
+                            if fd is None:
                                 break
-                    if setting['postProcessingCommand']:
-                            processingQueue.put({'model': self.modelo, 'path': self.file})
+                    finally:
+                        self.writer.close()
+                else:
+                    fd.close()
             except Exception as e:
-                with open('log.log', 'a+') as f:
-                    f.write(f'\n{datetime.datetime.now().strftime("%d/%m/%Y %H:%M:%S")} EXCEPTION: {e}\n')
+                log('recorder', f'EXCEPTION: {e}', 'error')
                 self.stop()
             finally:
                 self.exceptionHandler()
 
+    def newWriter(self):
+        return RecordingWriter(self.modelo, self.nextFile, diskBudget,
+            wrap=(lambda f: FFmpegRemuxer(f, self.modelo, setting['ffmpegPath'])) if setting['remux'] else None,
+            on_complete=self.completed, preallocate=setting['preallocate'], roll_size=setting['rollSize'],
+            roll_seconds=setting['rollSeconds'], unlink_check=setting['unlinkCheckInterval'], owner=setting['workerId'])
+
+    def nextFile(self):
+        now = datetime.datetime.now()
+        path = os.path.normpath(setting['directory_structure'].format(
+            path=setting['save_directory'], model=self.modelo, gender=prober.genders.get(self.modelo, 'unknown'),
+            year=now.strftime('%Y'), month=now.strftime('%m'), day=now.strftime('%d'),
+            hour=now.strftime('%H'), minutes=now.strftime('%M'), seconds=now.strftime('%S')))
+        if path == self.lastPath:
+            self.fileIndex += 1
+        else:
+            self.lastPath = path
+            self.fileIndex = 0
+        if self.fileIndex:
+            base, extension = os.path.splitext(path)
+            path = f'{base}_{self.fileIndex}{extension}'
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.file = path
+        return path
+
+    def completed(self, path):
+        if jobScheduler:
+            registry.add_job(self.modelo)
+        threading.Thread(target=self.finalize, args=(path,)).start()
+
+    def finalize(self, path):
+        if jobScheduler:
+            try:
+                jobScheduler.submit(self.modelo, path)
+            except Exception as e:
+                log('recorder', f'[{self.modelo}] Queueing post-processing of {path} failed: {e}', 'error')
+                registry.finish_postprocessing(self.modelo)
+            return
+        if setting['completed_directory']:
+            relative = os.path.relpath(path, setting['save_directory'])
+            if relative.startswith('..'):
+                relative = os.path.basename(path)
+            target = os.path.join(setting['completed_directory'], relative)
+            try:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.move(path, target)
+                if os.path.exists(path + '.gaps'):
+                    shutil.move(path + '.gaps', target + '.gaps')
+            except Exception as e:
+                log('recorder', f'[{self.modelo}] Could not move {path} to {target}: {e}', 'error')
+
+    def connect(self, hls_url):
+        max_attempts = 3
+        fd = None
+        if self.route is None:
+            hit, self.route = routeCache.lookup(self.modelo, 'stream')
+
+        for attempt in range(max_attempts):
+            proxy = None
+            try:
+                log('model_check', f'[{self.modelo}] Recording attempt {attempt+1}', 'debug')
+
+                if attempt == 0 and self.route:
+                    proxy = self.route
+                    proxy_url = proxy.get('https') or proxy.get('http')
+                    log('model_check', f'[{self.modelo}] Trying last working proxy: {proxy_url}', 'debug')
+                    openStart = time.time()
+                    fd = self.openStream(hls_url, proxy_url)
+                elif attempt == 0:
+                    log('model_check', f'[{self.modelo}] Trying direct stream connection...', 'debug')
+                    fd = self.openStream(hls_url)
+                else:
+                    proxy = proxy_manager.get_random_proxy(*routeCache.regions(self.modelo))
+                    if proxy:
+                        proxy_url = proxy.get('https') or proxy.get('http')
+                        log('model_check', f'[{self.modelo}] Trying with proxy: {proxy_url}', 'debug')
+                        openStart = time.time()
+                        fd = self.openStream(hls_url, proxy_url)
+                    else:
+                        log('model_check', f'[{self.modelo}] No proxy available for stream', 'warning')
+                        break
+
+                if proxy:
+                    proxy_manager.record_result(proxy, True, time.time() - openStart)
+                self.route = proxy
+                routeCache.remember(self.modelo, proxy, 'stream')
+                log('model_check', f'[{self.modelo}] ✓ Stream opened successfully!')
+                break
+            except Exception as e:
+                if proxy is self.route:
+                    self.route = None
+                    routeCache.forget(self.modelo, proxy, 'stream')
+                log('model_check', f'[{self.modelo}] Stream attempt {attempt+1} failed: {e}', 'warning')
+                proxy_manager.mark_proxy_failed(proxy)
+                if attempt < max_attempts - 1:
+                    time.sleep(2)
+                    continue
+                else:
+                    raise e
+
+        return fd
+
+    def lookup(self, proxy=None):
+        resp = sessionPool.http(proxy).get(API_URL.format(base=setting['siteUrl'], model=self.modelo), timeout=15 if proxy else 10)
+        json_data = resp.json()
+        if json_data.get('hls_source'):
+            return json_data['hls_source']
+        if 'hls_source' in json_data:
+            routeCache.offline(self.modelo, proxy)
+            return False
+        if json_data.get('code') == 'access-denied':
+            routeCache.deny(self.modelo, proxy)
+            raise GeoBlocked(json_data.get('detail', 'Not available in this region'))
+        raise Exception(json_data.get('detail', 'No hls_source in response'))
+
+    def resume(self, reason):
+        gapStart = time.time()
+        offset = self.bytesWritten
+        delay = 0.5
+        failures = 0
+        log('model_check', f'[{self.modelo}] Stream interrupted ({reason}), resuming...')
+        while not self._stopevent.is_set() and time.time() - gapStart < setting['resumeTimeout']:
+            try:
+                if failures < 2:
+                    hit, apiRoute = routeCache.lookup(self.modelo)
+                    hls_url = self.lookup(apiRoute if hit else self.route)
+                    fd = self.openStream(hls_url, self.route) if hls_url else None
+                else:
+                    hls_url = self.isOnline()
+                    fd = self.connect(hls_url) if hls_url else None
+                if hls_url is False:
+                    log('model_check', f'[{self.modelo}] Model went offline, not resuming')
+                    return None
+                gap = time.time() - gapStart
+                with open(self.file + '.gaps', 'a') as gaps:
+                    gaps.write(f'{datetime.datetime.fromtimestamp(gapStart).strftime("%Y.%m.%d_%H.%M.%S")} byte {offset}: {gap:.1f}s gap ({reason})\n')
+                log('model_check', f'[{self.modelo}] ✓ Stream resumed after {gap:.1f}s')
+                self.gaps += 1
+                return fd
+            except Exception as e:
+                failures += 1
+                log('model_check', f'[{self.modelo}] Resume attempt {failures} failed: {e}', 'warning')
+            self._stopevent.wait(delay)
+            delay = min(delay * 2, 8)
+        return None
+
+    def openStream(self, hls_url, proxy=None):
+        if setting['recorderMode'] == 'async':
+            return asyncio.run_coroutine_threadsafe(self.openAsync(hls_url, proxy), self.loop).result()
+        if setting['recorderMode'] == 'prefetch':
+            self.stream = HLSPrefetcher(hls_url, workers=setting['segmentWorkers'], prefetch_depth=setting['prefetchDepth'], live_edge=setting['liveEdge'], stall_timeout=setting['stallTimeout'], session=sessionPool.http(proxy), choose_variant=self.chooseVariant)
+            fd = self.stream.open()
+            self.streamStats = self.stream.stats
+            return fd
+        session = sessionPool.streamlink_session(proxy)
+        self.stream = None
+        if bandwidthBudget.total:
+            response = sessionPool.http(proxy).get(hls_url, timeout=15 if proxy else 10)
+            response.raise_for_status()
+            variants = parse_master_playlist(response.text, response.url)
+            if variants:
+                index = bandwidthBudget.register(self.modelo, [variant['bandwidth'] for variant in variants], self.switchVariant)
+                return HLSStream(session, variants[index]['url']).open()
+        return session.streams(f'hlsvariant://{hls_url}')['best'].open()
+
+    def chooseVariant(self, variants):
+        return bandwidthBudget.register(self.modelo, [variant['bandwidth'] for variant in variants], self.switchVariant)
+
+    def switchVariant(self, index):
+        stream = self.stream
+        if stream and stream.variants:
+            log('recorder', f'[{self.modelo}] Switching to the {stream.variants[index]["bandwidth"] / 1000000:.1f} Mbit/s variant to stay within the bandwidth budget')
+            stream.switch(index)
+        elif stream is None:
+            log('recorder', f'[{self.modelo}] Reopening the stream at another quality to stay within the bandwidth budget')
+            self.reopen = True
+
+    def capture(self, fd, f):
+        chunkSize = setting['chunkSize']
+        self.windowStart = time.time()
+        self.windowBytes = 0
+        reason = 'stopped'
+        while not self._stopevent.is_set():
+            if f.unlinked():
+                reason = 'unlinked'
+                break
+            if self.reopen:
+                self.reopen = False
+                reason = 'quality change'
+                break
+            try:
+                data = fd.read(chunkSize)
+                size = len(data)
+                if not size:
+                    reason = 'stream ended'
+                    break
+                if getattr(fd, 'rolled', False):
+                    fd.rolled = False
+                    if setting['remux']:
+                        f.roll()
+                f.write(data)
+            except Exception as e:
+                reason = f'error: {e}'
+                break
+            self.account(size)
+        fd.close()
+        return reason
+
+    def account(self, size):
+        if self.ttfb is None:
+            self.ttfb = time.time() - self.started
+            sessionPool.observe_ttfb(self.ttfb)
+        self.bytesWritten += size
+        self.windowBytes += size
+        now = time.time()
+        if now - self.windowStart >= 1:
+            rate = self.windowBytes / (now - self.windowStart)
+            self.throughput = rate if not self.throughput else self.throughput * 0.7 + rate * 0.3
+            self.windowStart = now
+            self.windowBytes = 0
+
     def exceptionHandler(self):
         self.stop()
         self.online = False
-        self.lock.acquire()
-        for index, hilo in enumerate(recording):
-            if hilo.modelo == self.modelo:
-                del recording[index]
-                break
-        self.lock.release()
-        try:
-            file = os.path.join(os.getcwd(), self.file)
-            if os.path.isfile(file):
-                if os.path.getsize(file) <= 1024:
-                    os.remove(file)
-        except Exception as e:
-            with open('log.log', 'a+') as f:
-                f.write(f'\n{datetime.datetime.now().strftime("%d/%m/%Y %H:%M:%S")} EXCEPTION: {e}\n')
+        bandwidthBudget.release(self.modelo)
+        registry.transition(self.modelo, IDLE, expected=self, current=(PROBING, RECORDING))
+        if cluster:
+            cluster.release(self.modelo)
 
     def isOnline(self):
-        log_msg = f'[{self.modelo}] Checking if online...'
-        with open('model_check.log', 'a') as f:
-            f.write(f'{log_msg}\n')
-
-        try:
-            resp = requests.get(f'https://chaturbate.com/api/chatvideocontext/{self.modelo}/', timeout=10)
-            json_data = resp.json()
-            with open('model_check.log', 'a') as f:
-                f.write(f'[{self.modelo}] Direct connection response: {json_data}\n')
-
-            hls_url = ''
-            if 'hls_source' in json_data:
-                hls_url = json_data['hls_source']
-            if len(hls_url):
-                with open('model_check.log', 'a') as f:
-                    f.write(f'[{self.modelo}] ✓ Found stream via direct connection\n')
-                return hls_url
+        log('model_check', f'[{self.modelo}] Checking if online...', 'debug')
+        if routeCache.negative(self.modelo):
+            log('model_check', f'[{self.modelo}] Offline or unreachable a moment ago, not checking again yet', 'debug')
+            return False
+
+        hit, cached = routeCache.lookup(self.modelo)
+        routes = [cached] if hit and cached else []
+        if not routeCache.is_denied(self.modelo):
+            routes.append(None)
+        for attempt in range(len(routes) + 3):
+            if attempt < len(routes):
+                proxy = routes[attempt]
             else:
-                with open('model_check.log', 'a') as f:
-                    f.write(f'[{self.modelo}] No stream in direct connection, trying proxy...\n')
-        except Exception as e:
-            with open('model_check.log', 'a') as f:
-                f.write(f'[{self.modelo}] Direct connection failed: {e}\n')
-
-        for attempt in range(3):
+                proxy = proxy_manager.get_random_proxy(*routeCache.regions(self.modelo))
+                if not proxy:
+                    log('model_check', f'[{self.modelo}] No proxy available', 'warning')
+                    break
+                if routeCache.is_denied(self.modelo, proxy):
+                    continue
+            via = f'proxy {proxy.get("http")}' if proxy else 'direct connection'
             try:
-                proxy = proxy_manager.get_random_proxy()
+                probeStart = time.time()
+                hls_url = self.lookup(proxy)
                 if proxy:
-                    with open('model_check.log', 'a') as f:
-                        f.write(f'[{self.modelo}] Attempt {attempt+1} with proxy: {proxy.get("http")}\n')
-
-                    resp = requests.get(f'https://chaturbate.com/api/chatvideocontext/{self.modelo}/', proxies=proxy, timeout=15)
-                    json_data = resp.json()
-                    with open('model_check.log', 'a') as f:
-                        f.write(f'[{self.modelo}] Proxy response: {json_data}\n')
-
-                    hls_url = ''
-                    if 'hls_source' in json_data:
-                        hls_url = json_data['hls_source']
-                    if len(hls_url):
-                        with open('model_check.log', 'a') as f:
-                            f.write(f'[{self.modelo}] ✓ Found stream via PROXY!\n')
-                        return hls_url
-                else:
-                    with open('model_check.log', 'a') as f:
-                        f.write(f'[{self.modelo}] No proxy available\n')
-                    break
+                    proxy_manager.record_result(proxy, True, time.time() - probeStart)
+                if hls_url:
+                    log('model_check', f'[{self.modelo}] ✓ Found stream via {via}')
+                    routeCache.remember(self.modelo, proxy)
+                    return hls_url
+                log('model_check', f'[{self.modelo}] ✗ Model offline', 'debug')
+                return False
+            except GeoBlocked as e:
+                log('model_check', f'[{self.modelo}] Geo-blocked via {via}: {e}', 'debug')
             except Exception as e:
-                with open('model_check.log', 'a') as f:
-                    f.write(f'[{self.modelo}] Proxy attempt {attempt+1} failed: {e}\n')
-                proxy_manager.mark_proxy_failed(proxy)
-                continue
+                log('model_check', f'[{self.modelo}] Check via {via} failed: {e}', 'warning')
+                if proxy:
+                    proxy_manager.mark_proxy_failed(proxy)
+                    routeCache.forget(self.modelo, proxy)
 
-        with open('model_check.log', 'a') as f:
-            f.write(f'[{self.modelo}] ✗ Model offline or geo-blocked (no working proxy)\n')
+        log('model_check', f'[{self.modelo}] ✗ Model offline or geo-blocked (no working proxy)', 'warning')
+        routeCache.unreachable(self.modelo)
         return False
 
     def stop(self):
         self._stopevent.set()
 
-class CleaningThread(threading.Thread):
-    def __init__(self):
-        threading.Thread.__init__(self)
-        self.interval = 0
-        self.lock = threading.Lock()
-        
-    def run(self):
-        global hilos, recording
-        while True:
-            self.lock.acquire()
-            new_hilos = []
-            for hilo in hilos:
-                if hilo.is_alive() or hilo.online:
-                    new_hilos.append(hilo)
-            hilos = new_hilos
-            self.lock.release()
-            for i in range(10, 0, -1):
-                self.interval = i
-                time.sleep(1)
+class AsyncModelo(Modelo):
+    def __init__(self, modelo, hls_source=None):
+        Modelo.__init__(self, modelo, hls_source)
+        self.done = threading.Event()
+
+    def start(self):
+        recorderPool.submit(self.record(), self.finished)
+
+    def join(self, timeout=None):
+        self.done.wait(timeout)
+
+    def is_alive(self):
+        return not self.done.is_set()
+
+    async def record(self):
+        self.loop = asyncio.get_running_loop()
+        hls_url = self.hls_source or await recorderPool.call(self.isOnline)
+        if not hls_url:
+            self.online = False
+            return
+        self.online = True
+        stream = await recorderPool.reconnect(self.connect, hls_url)
+        if not stream:
+            raise Exception('Failed to open stream after all attempts')
+        if not registry.transition(self.modelo, RECORDING, expected=self):
+            stream.close()
+            return
+        self.writer = await recorderPool.write(self.newWriter)
+        try:
+            while True:
+                reason = await self.captureAsync(stream)
+                if reason in ('stopped', 'unlinked') or self.writer.failed():
+                    break
+                stream = await recorderPool.reconnect(self.resume, reason)
+                if stream is None:
+                    break
+        finally:
+            await recorderPool.write(self.writer.finish)
+
+    async def openAsync(self, hls_url, proxy=None):
+        proxy = route_key(proxy)
+        stream = AsyncHLSStream(recorderPool.session(), hls_url, proxy=None if proxy == DIRECT else proxy, prefetch_depth=setting['prefetchDepth'], live_edge=setting['liveEdge'], stall_timeout=setting['stallTimeout'], choose_variant=self.chooseVariant)
+        self.stream = stream
+        await stream.open()
+        self.streamStats = stream.stats
+        return stream
+
+    async def captureAsync(self, stream):
+        self.windowStart = time.time()
+        self.windowBytes = 0
+        reason = 'stopped'
+        try:
+            while not self._stopevent.is_set():
+                if self.writer.unlinked():
+                    reason = 'unlinked'
+                    break
+                try:
+                    data = await stream.read()
+                except Exception as e:
+                    reason = f'error: {e}'
+                    break
+                if not data:
+                    reason = 'stream ended'
+                    break
+                if stream.rolled:
+                    stream.rolled = False
+                    if setting['remux']:
+                        await recorderPool.write(self.writer.roll_file)
+                await recorderPool.write(self.writer.process, data)
+                self.account(len(data))
+        finally:
+            stream.close()
+        return reason
+
+    def switchVariant(self, index):
+        self.loop.call_soon_threadsafe(Modelo.switchVariant, self, index)
+
+    def finished(self, future):
+        recorderPool.blocking.submit(self.cleanup, future)
+
+    def cleanup(self, future):
+        if not future.cancelled() and future.exception():
+            log('recorder', f'EXCEPTION: {future.exception()}', 'error')
+        self.exceptionHandler()
+        self.done.set()
 
 class ProxyUpdateThread(threading.Thread):
     def __init__(self):
@@ -251,9 +553,14 @@ class ProxyUpdateThread(threading.Thread):
         self.daemon = True
 
     def run(self):
+        try:
+            proxy_manager.revalidate_cache()
+        except:
+            pass
         while True:
             try:
                 proxy_manager.update_proxies()
+                proxy_manager.save_cache()
                 time.sleep(300)
             except:
                 time.sleep(60)
@@ -261,74 +568,233 @@ class ProxyUpdateThread(threading.Thread):
 class AddModelsThread(threading.Thread):
     def __init__(self):
         threading.Thread.__init__(self)
-        self.wanted = []
-        self.lock = threading.Lock()
-        self.repeatedModels = []
-        self.counterModel = 0
+        self.daemon = True
+        self.lastSave = time.time()
 
     def run(self):
-        global hilos, recording
-        lines = open(setting['wishlist'], 'r').read().splitlines()
-        self.wanted = (x for x in lines if x)
-        self.lock.acquire()
-        aux = []
-        for model in self.wanted:
-            model = model.lower()
-            if model in aux:
-                self.repeatedModels.append(model)
-            else:
-                aux.append(model)
-                self.counterModel = self.counterModel + 1
-                if not isModelInListofObjects(model, hilos) and not isModelInListofObjects(model, recording):
-                    thread = Modelo(model)
+        while True:
+            try:
+                self.check()
+            except Exception as e:
+                log('model_check', f'EXCEPTION: {e}', 'error')
+            if time.time() - self.lastSave >= 300:
+                self.lastSave = time.time()
+                routeCache.prune()
+                try:
+                    scheduler.save()
+                except Exception as e:
+                    log('model_check', f'Could not save probe history: {e}', 'warning')
+            time.sleep(1)
+
+    def check(self):
+        added, removed = registry.reload_wishlist(setting['wishlist'])
+        if added or removed:
+            log('model_check', f'Wishlist reloaded: {len(added)} added, {len(removed)} removed')
+        for model in added:
+            scheduler.add(model)
+        for model in removed:
+            scheduler.discard(model)
+            routeCache.discard(model)
+        if diskGuard.paused:
+            return
+        due = scheduler.due()
+        if cluster:
+            owned = []
+            for model in due:
+                if cluster.owns(model):
+                    owned.append(model)
+                else:
+                    scheduler.reschedule(model, scheduler.min_interval)
+            due = owned
+        if not due:
+            return
+        toProbe = registry.claim(due)
+        claimed = set(toProbe)
+        for model in due:
+            if model not in claimed:
+                scheduler.defer(model)
+        online = None
+        candidates = []
+        try:
+            candidates = toProbe
+            if setting['presenceMode'] == 'bulk':
+                candidates = prober.bulk_candidates(toProbe, setting['genders'], max_age=setting['interval'])
+            online = prober.probe(candidates)
+            for model, hls_url in online.items():
+                if cluster and not cluster.acquire(model):
+                    continue
+                thread = AsyncModelo(model, hls_url) if recorderPool else Modelo(model, hls_url)
+                if registry.attach(model, thread):
                     thread.start()
-                    hilos.append(thread)
-        for hilo in recording:
-            if hilo.modelo not in aux:
-                hilo.stop()
-        self.lock.release()
-
-def isModelInListofObjects(obj, lista):
-    result = False
-    for i in lista:
-        if i.modelo == obj:
-            result = True
-            break
-    return result
+                elif cluster:
+                    cluster.release(model)
+        finally:
+            registry.release(toProbe)
+            probed = set(candidates) if online is not None else set()
+            for model in toProbe:
+                if model in probed:
+                    scheduler.record(model, model in online)
+                else:
+                    scheduler.reschedule(model, scheduler.min_interval)
+
+def collectStatus():
+    recordings = []
+    for hilo in registry.threads(RECORDING):
+        entry = {
+            'model': hilo.modelo,
+            'file': hilo.file,
+            'route': 'proxy' if hilo.route else 'direct',
+            'bytes': hilo.bytesWritten,
+            'throughput': hilo.throughput,
+            'gaps': hilo.gaps,
+            'ttfb': hilo.ttfb,
+            }
+        entry.update(bandwidthBudget.allocation(hilo.modelo))
+        if hilo.streamStats:
+            entry.update(hilo.streamStats)
+        if hilo.writer:
+            entry['buffered'] = hilo.writer.stats['buffered']
+            entry['files'] = hilo.writer.stats['files']
+            if hasattr(hilo.writer.sink, 'cpu_seconds'):
+                hilo.writer.sink.cpu_seconds()
+                entry.update(hilo.writer.sink.stats)
+        recordings.append(entry)
+    proxy = dict(proxy_manager.stats)
+    proxy['working'] = proxy_manager.get_proxy_count()
+    proxy['regions'] = proxy_manager.region_counts()
+    return {
+        'time': time.time(),
+        'wanted': registry.wanted_count,
+        'states': registry.counts(),
+        'starting': [hilo.modelo for hilo in registry.threads(PROBING)],
+        'recordings': recordings,
+        'prober': prober.status(),
+        'schedule': scheduler.status(),
+        'proxy': proxy,
+        'sessions': sessionPool.status(),
+        'recorder': recorderPool.status() if recorderPool else {},
+        'routes': routeCache.status(),
+        'bandwidth': bandwidthBudget.status(),
+        'postprocessing': jobScheduler.status() if jobScheduler else {'queue_depth': 0},
+        'disk': dict(diskBudget.stats, free=diskGuard.free, paused=diskGuard.paused),
+        'cluster': dict(cluster.stats, worker=cluster.worker_id) if cluster else None,
+        }
+
+def runCoordinator():
+    count = argValue('--coordinator', '')
+    count = int(count) if count.isdigit() else os.cpu_count() or 1
+    command = [sys.executable, os.path.abspath(sys.argv[0]), '--config', configFile, '--headless', '--metrics-port', '0']
+    coordinator = Coordinator(setting['clusterDirectory'], setting['leaseTimeout'], command, count)
+    coordinator.start()
+    if setting['metricsPort']:
+        metricsServer = MetricsServer(coordinator.status, setting['metricsPort'], setting['metricsHost'])
+        metricsServer.start()
+        print(f'Serving cluster /metrics and /status on http://{setting["metricsHost"]}:{setting["metricsPort"]}/')
+    try:
+        while True:
+            time.sleep(setting['interval'] if setting['headless'] else 1)
+            if setting['headless']:
+                continue
+            status = coordinator.status()
+            cls()
+            print(f'{sum(w["alive"] for w in status["workers"])} of {len(status["workers"])} workers alive, {count} started here ({status["restarts"]} restarts), {status["wanted"]} models in wanted')
+            for worker in status['workers']:
+                print(f'  Worker: {worker["id"]} on {worker["host"]} (pid {worker["pid"]})  -->  {worker["recordings"]} recordings, last heartbeat {worker["age"]:.0f}s ago{"" if worker["alive"] else " (lost)"}')
+            print('The following models are being recorded:')
+            for recording in status['recordings']:
+                print(f'  Model: {recording["model"]}  -->  {recording["worker"]}  ({recording["bytes"] / 1048576:.1f} MB, {recording["throughput"] / 1024:.0f} KB/s)')
+    except KeyboardInterrupt:
+        coordinator.stop()
+
+jobScheduler = None
+recorderPool = None
+cluster = None
+diskBudget = None
+diskGuard = None
+addModelsThread = None
 
 if __name__ == '__main__':
     readConfig()
+    writer.start()
+    if '--coordinator' in sys.argv:
+        if not setting['clusterDirectory']:
+            sys.exit('Set clusterDirectory in the config file to run a coordinator')
+        runCoordinator()
+        sys.exit()
     if setting['postProcessingCommand']:
-        processingQueue = queue.Queue()
-        postprocessingWorkers = []
-        for i in range(0, setting['postProcessingThreads']):
-            t = threading.Thread(target=postProcess)
-            postprocessingWorkers.append(t)
-            t.start()
+        jobScheduler = JobScheduler(setting['postProcessingCommand'], setting['postProcessingDb'], max_workers=setting['postProcessingThreads'], timeout=setting['postProcessingTimeout'], retries=setting['postProcessingRetries'], priority=setting['postProcessingPriority'], on_finished=registry.finish_postprocessing, keep_finished=setting['postProcessingKeepDays'] * 86400)
+        jobScheduler.start()
+
+    diskBudget = WriteBudget(setting['writeBuffer'])
+    diskGuard = DiskGuard(setting['save_directory'], setting['minFreeSpace'])
+    diskGuard.check()
+    repaired = repair_recordings(setting['save_directory'], setting['workerId'])
+    if repaired:
+        print(f'Trimmed {repaired} recordings left unfinished by the last run')
+    diskGuard.start()
+
+    sessionPool = SessionPool(setting['httpPoolSize'], setting['sessionRoutes'], setting['stallTimeout'])
+    if setting['recorderMode'] == 'async':
+        recorderPool = RecorderPool(setting['recorderLoops'], setting['diskThreads'], resume_threads=setting['resumeThreads'])
+    bandwidthBudget = BandwidthBudget(setting['bandwidthBudget'], priority_of=registry.priority)
+    routeCache = RouteCache(setting['routeCacheTtl'], setting['negativeCacheTtl'], region_of=proxy_manager.region)
+    prober = OnlineProber(proxy_manager, concurrency=setting['probeConcurrency'], base_url=setting['siteUrl'], route_cache=routeCache)
+    scheduler = ProbeScheduler(setting['interval'], setting['maxCheckInterval'], rate=setting['probeRate'], jitter=setting['probeJitter'], history_file=setting['probeHistoryFile'])
+    scheduler.load()
 
     print('Initializing proxy system...')
+    proxy_manager.cache_file = setting['proxyCacheFile']
+    proxy_manager.fetch_lists = setting['fetchProxyLists']
+    proxy_manager.validate_url = API_URL.format(base=setting['siteUrl'], model=setting['proxyTestModel'])
+    proxy_manager.load_cache()
     proxyUpdateThread = ProxyUpdateThread()
     proxyUpdateThread.start()
 
-    cleaningThread = CleaningThread()
-    cleaningThread.start()
+    if setting['metricsPort']:
+        metricsServer = MetricsServer(collectStatus, setting['metricsPort'], setting['metricsHost'])
+        metricsServer.start()
+        print(f'Serving /metrics and /status on http://{setting["metricsHost"]}:{setting["metricsPort"]}/')
+    if setting['clusterDirectory']:
+        cluster = ClusterMember(setting['clusterDirectory'], setting['workerId'], setting['leaseTimeout'], status=collectStatus, on_lost=registry.stop)
+        cluster.beat()
+        cluster.start()
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit())
+    addModelsThread = AddModelsThread()
+    addModelsThread.start()
     while True:
         try:
             readConfig()
-            addModelsThread = AddModelsThread()
-            addModelsThread.start()
-            i = 1
+            bandwidthBudget.resize(setting['bandwidthBudget'])
             for i in range(setting['interval'], 0, -1):
+                if setting['headless']:
+                    time.sleep(1)
+                    continue
                 cls()
-                if len(addModelsThread.repeatedModels): print('The following models are more than once in wanted: [\'' + ', '.join(modelo for modelo in addModelsThread.repeatedModels) + '\']')
-                print(f'{len(hilos):02d} alive Threads (1 Thread per non-recording model), cleaning dead/not-online Threads in {cleaningThread.interval:02d} seconds, {addModelsThread.counterModel:02d} models in wanted')
-                print(f'Online Threads (models): {len(recording):02d}')
-                print(f'Working proxies available: {proxy_manager.get_proxy_count()}')
+                if len(registry.repeated): print('The following models are more than once in wanted: [\'' + ', '.join(modelo for modelo in registry.repeated) + '\']')
+                print(f'{registry.count(PROBING):02d} models being probed or starting, {registry.count(POSTPROCESSING):02d} waiting on post-processing, {registry.wanted_count:02d} models in wanted')
+                print(f'Last probe batch: {prober.stats["last_probed"]} models, {prober.stats["last_online"]} online, {prober.stats["last_requests"]} requests in {prober.stats["last_cycle_seconds"]:.2f}s (avg {prober.stats["avg_cycle_seconds"]:.2f}s)')
+                print(f'Probe schedule: {scheduler.stats["scheduled"]} models scheduled, {scheduler.stats["backlog"]} due but over the {setting["probeRate"]:g}/s budget, {scheduler.stats["probes"]} probes so far')
+                if setting['presenceMode'] == 'bulk': print(f'Last room listing: {prober.stats["last_listing_rooms"]} online rooms from {prober.stats["last_listing_pages"]} pages in {prober.stats["last_listing_seconds"]:.2f}s')
+                print(f'Online Threads (models): {registry.count(RECORDING):02d}')
+                print(f'Disk: {(diskGuard.free or 0) / 1073741824:.1f} GB free{" (new recordings paused)" if diskGuard.paused else ""}, {diskBudget.stats["buffered"] / 1048576:.0f} of {setting["writeBuffer"] / 1048576:.0f} MB write buffer in use')
+                bandwidth = bandwidthBudget.status()
+                if bandwidth['total']: print(f'Bandwidth: {bandwidth["allocated"] / 1000000:.1f} of {bandwidth["total"] / 1000000:g} Mbit/s allocated, {bandwidth["downshifted"]} recordings below their best quality, {bandwidth["switches"]} quality switches')
+                print(f'Working proxies available: {proxy_manager.get_proxy_count()} (last refresh took {proxy_manager.stats["last_refresh_seconds"]:.1f}s)')
+                print(f'Route cache: {routeCache.stats["hits"]} hits, {routeCache.stats["misses"]} misses, {routeCache.stats["negative_hits"]} checks skipped, {routeCache.stats["skipped_routes"]} blocked routes skipped')
                 print('The following models are being recorded:')
-                for hiloModelo in recording: print(f'  Model: {hiloModelo.modelo}  -->  File: {os.path.basename(hiloModelo.file)}')
-                print(f'Next check in {i:02d} seconds\r', end='')
+                for hiloModelo in registry.threads(RECORDING):
+                    print(f'  Model: {hiloModelo.modelo}  -->  File: {os.path.basename(hiloModelo.file)}  ({hiloModelo.bytesWritten / 1048576:.1f} MB, {hiloModelo.throughput / 1024:.0f} KB/s)')
+                    if hiloModelo.streamStats: print(f'    segments: {hiloModelo.streamStats["segments"]}, dropped: {hiloModelo.streamStats["dropped"]}, fetch latency: {hiloModelo.streamStats["fetch_latency"]:.2f}s, behind live: {hiloModelo.streamStats["lag_seconds"]:.0f}s, quality: {hiloModelo.streamStats["variant_bandwidth"] / 1000000:.1f} Mbit/s')
+                print(f'Reloading config in {i:02d} seconds\r', end='')
                 time.sleep(1)
-            addModelsThread.join()
-            del addModelsThread, i
         except:
+            scheduler.save()
+            if cluster:
+                cluster.leave()
+            stopping = registry.threads(PROBING) + registry.threads(RECORDING)
+            for thread in stopping:
+                thread.stop()
+            deadline = time.time() + (setting['leaseTimeout'] if cluster else SHUTDOWN_TIMEOUT)
+            for thread in stopping:
+                thread.join(max(deadline - time.time(), 0))
             break
@@ -1,9 +1,13 @@
-import requests, configparser, sys, pickle, os
+import requests, configparser, sys, pickle, os, time
+import lxml.html
 from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor
+from onlineProber import ROOM_TITLES, last_page
 
 
 
 followed = []
+FOLLOWED_URL = 'https://chaturbate.com/followed-cams/?keywords=&page={}'
 
 Config = configparser.ConfigParser()
 Config.read(sys.path[0] + "/config.conf")
@@ -46,22 +50,57 @@ def checkLogin(result):
     else:
         return True
 
+def pageModels(doc):
+    return [href.strip('/').lower() for href in ROOM_TITLES(doc)]
+
+
+def getPage(page):
+    result = s.get(FOLLOWED_URL.format(page), timeout=15)
+    return pageModels(lxml.html.fromstring(result.content))
+
+
 def getModels():
     print("getting followed models...")
-    page = 1
-    while True:
-        result = s.get('https://chaturbate.com/followed-cams/?keywords=&page={}'.format(page))
-        soup = BeautifulSoup(result.text, 'lxml')
-        LIST = soup.findAll('ul', {'class': 'list'})[0]
-        models = LIST.find_all('div', {'class': 'title'})
-        for model in models:
-            followed.append(model.find_all('a', href=True)[0].string.lower()[1:])
-        try:
-            if int(soup.findAll('li', {'class': 'active'})[1].string) >= int(soup.findAll('a', {'class': 'endless_page_link'})[-2].string):
-                break
-            else:
-                page += 1
-        except IndexError: break
+    start = time.time()
+    result = s.get(FOLLOWED_URL.format(1), timeout=15)
+    first = lxml.html.fromstring(result.content)
+    pages = last_page(first)
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=16)
+    s.mount('https://', adapter)
+    rooms = [pageModels(first)]
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        rooms.extend(executor.map(getPage, range(2, pages + 1)))
+    seen = set()
+    for page in rooms:
+        for model in page:
+            if model not in seen:
+                seen.add(model)
+                followed.append(model)
+    print('{} pages read in {:.1f}s'.format(pages, time.time() - start))
+
+
+def normalize(line):
+    parts = line.split()
+    return parts[0].split('chaturbate.com/')[-1].lower().replace('/', '') if parts else ''
+
+
+def mergeWishlist(models):
+    with open(wishlist, 'rb') as f:
+        current = f.read()
+    wanted = {normalize(line) for line in current.decode().splitlines()}
+    wanted.discard('')
+    print('{} models currently in the wanted list'.format(len(wanted)))
+    added = [model for model in models if model not in wanted]
+    if added:
+        if current and not current.endswith(b'\n'):
+            current += b'\n'
+        tmp = wishlist + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(current + ''.join(model + '\n' for model in added).encode())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, wishlist)
+    return added
 
 
 if __name__ == '__main__':
@@ -74,15 +113,8 @@ if __name__ == '__main__':
     if not checkLogin(result):
         login()
     getModels()
-    print('{} followed models'.format(len(set(followed))))
-    f = open(wishlist, 'r')
-    wanted = list(set(f.readlines()))
-    wanted = [m.strip('\n').split('chaturbate.com/')[-1].lower().strip().replace('/', '') for m in wanted]
-    print('{} models currently in the wanted list'.format(len(wanted)))
-    followed.extend(wanted)
-    f= open(wishlist, 'w')
-    for model in set(followed):
-        f.write(model + '\n')
-    print('{} models have been added to the wanted list'.format(len(set(followed)) - len(set(wanted))))
+    print('{} followed models'.format(len(followed)))
+    added = mergeWishlist(followed)
+    print('{} models have been added to the wanted list'.format(len(added)))
     with open (sys.path[0] + "/" +username + '.pickle', 'wb') as f:
         pickle.dump(s, f)
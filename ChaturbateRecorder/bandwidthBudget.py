@@ -0,0 +1,93 @@
+import threading
+import time
+from logWriter import log
+
+
+class BandwidthBudget:
+    def __init__(self, total=0, priority_of=None):
+        self.total = total
+        self.priority_of = priority_of or (lambda model: 0)
+        self.lock = threading.Lock()
+        self.streams = {}
+        self.over = False
+        self.stats = {'switches': 0, 'downshifts': 0, 'upshifts': 0}
+
+    def register(self, model, bandwidths, switch=None):
+        with self.lock:
+            self.streams[model] = {
+                'bandwidths': bandwidths,
+                'index': len(bandwidths) - 1,
+                'switch': switch,
+                'since': self.streams.get(model, {}).get('since', time.time()),
+            }
+            changes = self._allocate(model)
+            index = self.streams[model]['index']
+        self._apply(changes)
+        return index
+
+    def release(self, model):
+        with self.lock:
+            if self.streams.pop(model, None) is None:
+                return
+            changes = self._allocate()
+        self._apply(changes)
+
+    def resize(self, total):
+        with self.lock:
+            self.total = total
+            changes = self._allocate()
+        self._apply(changes)
+
+    def _allocate(self, opening=None):
+        adjustable = []
+        spare = self.total
+        for model, entry in self.streams.items():
+            entry['priority'] = self.priority_of(model)
+            if entry['switch'] is None and model != opening:
+                spare -= entry['bandwidths'][entry['index']]
+            else:
+                adjustable.append((model, entry))
+                spare -= entry['bandwidths'][0]
+
+        changes = []
+        adjustable.sort(key=lambda item: (-item[1]['priority'], item[1]['since']))
+        for model, entry in adjustable:
+            bandwidths = entry['bandwidths']
+            index = len(bandwidths) - 1
+            if self.total:
+                index = 0
+                for candidate, bandwidth in enumerate(bandwidths):
+                    if bandwidth - bandwidths[0] <= spare:
+                        index = candidate
+                spare -= bandwidths[index] - bandwidths[0]
+            if index != entry['index']:
+                if model != opening:
+                    self.stats['switches'] += 1
+                    self.stats['downshifts' if index < entry['index'] else 'upshifts'] += 1
+                    changes.append((entry['switch'], index))
+                entry['index'] = index
+        over = bool(self.total) and spare < 0
+        if over and not self.over:
+            log('recorder', f'Bandwidth budget exceeded: {len(self.streams)} recordings need {(self.total - spare) / 1000000:.1f} of {self.total / 1000000:g} Mbit/s even at their lowest allowed quality', 'warning')
+        self.over = over
+        return changes
+
+    def _apply(self, changes):
+        for switch, index in changes:
+            try:
+                switch(index)
+            except Exception:
+                pass
+
+    def allocation(self, model):
+        with self.lock:
+            entry = self.streams.get(model)
+            if entry is None:
+                return {}
+            return {'priority': entry.get('priority', 0), 'variant_bandwidth': entry['bandwidths'][entry['index']], 'best_bandwidth': entry['bandwidths'][-1]}
+
+    def status(self):
+        with self.lock:
+            allocated = sum(entry['bandwidths'][entry['index']] for entry in self.streams.values())
+            downshifted = sum(1 for entry in self.streams.values() if entry['index'] < len(entry['bandwidths']) - 1)
+            return dict(self.stats, total=self.total, allocated=allocated, streams=len(self.streams), downshifted=downshifted, over_budget=self.over)
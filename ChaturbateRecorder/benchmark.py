@@ -0,0 +1,346 @@
+import argparse, json, os, random, shutil, signal, socket, subprocess, sys, tempfile, threading, time, urllib.request
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+TS_PACKET = b'\x47\x1f\xff\x10' + bytes(184)
+ROOMS_PER_PAGE = 90
+REGIONS = ('US', 'DE', 'NL', 'GB', 'FR')
+RESOLUTIONS = ('426x240', '640x360', '854x480', '1280x720', '1920x1080', '2560x1440', '3840x2160')
+MISMATCH_SHARE = 0.1
+
+
+class FakeSite(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        site = self.server.site
+        url = urlparse(self.path)
+        parts = url.path.strip('/').split('/')
+        region = self.headers.get('X-Bench-Proxy')
+        if parts[:2] == ['api', 'chatvideocontext'] and len(parts) == 3:
+            site.count('api')
+            state = site.models.get(parts[2])
+            if state == 'geo' and region != site.regions.get(parts[2]):
+                site.count('api_denied')
+                body = {'code': 'access-denied', 'detail': 'This room is not available to your region.'}
+            elif state in ('live', 'geo'):
+                body = {'hls_source': f'{site.url}/hls/{parts[2]}/master.m3u8', 'broadcaster_gender': 'female'}
+            else:
+                body = {'hls_source': '', 'broadcaster_gender': 'female'}
+            self.reply(json.dumps(body).encode(), 'application/json')
+        elif parts[0] == 'hls' and len(parts) == 3 and parts[2] == 'master.m3u8':
+            site.count('playlist')
+            lines = ['#EXTM3U']
+            first = max(RESOLUTIONS.index('1920x1080') + 1 - len(site.bitrates), 0)
+            for i, bitrate in enumerate(site.bitrates):
+                resolution = RESOLUTIONS[min(first + i, len(RESOLUTIONS) - 1)]
+                lines += [f'#EXT-X-STREAM-INF:BANDWIDTH={bitrate * 1000},RESOLUTION={resolution}', f'{bitrate}.m3u8']
+            self.reply(('\n'.join(lines) + '\n').encode(), 'application/vnd.apple.mpegurl')
+        elif parts[0] == 'hls' and len(parts) == 3:
+            site.count('playlist')
+            newest = site.sequence()
+            first = newest - 5
+            lines = ['#EXTM3U', '#EXT-X-VERSION:3', f'#EXT-X-TARGETDURATION:{site.segment_seconds:g}', f'#EXT-X-MEDIA-SEQUENCE:{first}']
+            for seq in range(first, newest + 1):
+                lines += [f'#EXTINF:{site.segment_seconds:.3f},', f'{parts[2][:-5]}/{seq}.ts']
+            self.reply(('\n'.join(lines) + '\n').encode(), 'application/vnd.apple.mpegurl')
+        elif parts[0] == 'hls' and len(parts) == 4:
+            site.count('segment')
+            body = site.segment(int(parts[2]))
+            site.count('segment_bytes', len(body))
+            self.reply(body, 'video/mp2t')
+        elif parts[0].endswith('-cams'):
+            site.count('listing')
+            page = int(parse_qs(url.query).get('page', ['1'])[0])
+            rooms = [name for name, state in site.models.items() if state != 'offline']
+            pages = max((len(rooms) + ROOMS_PER_PAGE - 1) // ROOMS_PER_PAGE, 1)
+            items = ''.join(f'<li><div class="title"><a href="/{name}/">{name}</a></div></li>' for name in rooms[(page - 1) * ROOMS_PER_PAGE:page * ROOMS_PER_PAGE])
+            links = ''.join(f'<a class="endless_page_link" href="?page={p}">{p}</a>' for p in range(1, pages + 1))
+            self.reply(f'<html><body><ul class="list">{items}</ul><ul class="paging">{links}<a class="endless_page_link">next</a></ul></body></html>'.encode(), 'text/html')
+        else:
+            self.send_error(404)
+
+    def reply(self, body, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeProxy(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.site.count('proxied')
+        request = urllib.request.Request(self.path, headers={'X-Bench-Proxy': self.server.region})
+        try:
+            with urllib.request.urlopen(request, timeout=10) as response:
+                body = response.read()
+                status = response.status
+        except Exception:
+            self.send_error(502)
+            return
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Site:
+    def __init__(self, models, bitrates, segment_seconds, regions=None):
+        self.models = models
+        self.regions = regions or {}
+        self.bitrates = sorted(bitrates)
+        self.segment_seconds = segment_seconds
+        self.started = time.time()
+        self.segments = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.url = None
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def sequence(self):
+        return int((time.time() - self.started) / self.segment_seconds) + 10
+
+    def segment(self, bitrate):
+        if bitrate not in self.segments:
+            size = int(bitrate * 1000 / 8 * self.segment_seconds)
+            self.segments[bitrate] = TS_PACKET * (size // len(TS_PACKET) + 1)
+        return self.segments[bitrate]
+
+
+def serve(handler, site, region=None):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    server.site = site
+    server.region = region
+    server.handle_error = lambda request, address: None
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}'
+
+
+def freePort():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def writeConfig(workdir, site_url, port):
+    with open(os.path.join(workdir, 'bench.conf'), 'w') as f:
+        f.write(f'''[paths]
+wishlist = {workdir}/wanted.txt
+save_directory = {workdir}/captures
+completed_directory =
+
+[settings]
+checkInterval = {args.check_interval}
+probeConcurrency = {args.probe_concurrency}
+probeRate = 0
+presenceMode = {args.presence_mode}
+recorderMode = {args.mode}
+bandwidthBudget = {args.budget or ''}
+remux = {str(args.remux).lower()}
+siteUrl = {site_url}
+metricsPort = {port}
+metricsHost = 127.0.0.1
+headless = true
+genders = female
+proxyCacheFile = {workdir}/proxy_cache.json
+fetchProxyLists = false
+probeHistoryFile = {workdir}/probe_history.json
+postProcessingCommand =
+postProcessingThreads = 1
+postProcessingDb = {workdir}/postprocessing.db
+minFreeSpaceMB = 0
+clusterDirectory = {workdir + '/cluster' if args.workers else ''}
+
+[logging]
+level = info
+''')
+
+
+def processTree(pid):
+    parents = {}
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    parents.setdefault(int(f.read().rsplit(')', 1)[1].split()[1]), []).append(int(entry))
+            except (OSError, IndexError, ValueError):
+                pass
+    pids = [pid]
+    for parent in pids:
+        pids.extend(parents.get(parent, []))
+    return pids
+
+
+def usage(pid):
+    cpu = 0.0
+    rss = 0
+    ticks = os.sysconf('SC_CLK_TCK')
+    page = os.sysconf('SC_PAGE_SIZE')
+    for child in processTree(pid):
+        try:
+            with open(f'/proc/{child}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            cpu += (int(fields[11]) + int(fields[12])) / ticks
+            with open(f'/proc/{child}/statm') as f:
+                rss += int(f.read().split()[1]) * page
+        except (OSError, IndexError, ValueError):
+            pass
+    return cpu, rss
+
+
+def fetchStatus(port):
+    with urllib.request.urlopen(f'http://127.0.0.1:{port}/status', timeout=5) as response:
+        return json.load(response)
+
+
+def recorded(status):
+    recordings = status.get('recordings', [])
+    return sum(r['bytes'] for r in recordings), sum(r.get('dropped') or 0 for r in recordings), sum(r['gaps'] for r in recordings)
+
+
+def run():
+    names = [f'bench{i:05d}' for i in range(args.models)]
+    live = int(args.models * args.live)
+    geo = int(args.models * args.geo)
+    models = {}
+    for index, name in enumerate(names):
+        models[name] = 'live' if index < live else 'geo' if index < live + geo else 'offline'
+    proxyRegions = [REGIONS[i % len(REGIONS)] for i in range(args.proxies)]
+    used = sorted(set(proxyRegions)) or [REGIONS[0]]
+    regions = {name: used[index % len(used)] for index, name in enumerate(names) if models[name] == 'geo'}
+    site = Site(models, [int(b) for b in args.bitrates.split(',')], args.segment_seconds, regions)
+    site.url = serve(FakeSite, site)
+    proxies = [serve(FakeProxy, site, region) for region in proxyRegions]
+
+    workdir = tempfile.mkdtemp(prefix='cbrec-bench-')
+    with open(os.path.join(workdir, 'wanted.txt'), 'w') as f:
+        f.write('\n'.join(f'{name} {random.randint(0, 2)}' if args.budget else name for name in random.sample(names, len(names))) + '\n')
+    with open(os.path.join(workdir, 'proxy_cache.json'), 'w') as f:
+        json.dump({proxy: [0.05, 1.0, int(time.time()), region] for proxy, region in zip(proxies, proxyRegions)}, f)
+    port = freePort()
+    writeConfig(workdir, site.url, port)
+
+    command = [sys.executable, os.path.join(sys.path[0], 'ChaturbateRecorder.py'), '--config', os.path.join(workdir, 'bench.conf'), '--headless']
+    if args.workers:
+        command += ['--coordinator', str(args.workers)]
+    recorder = subprocess.Popen(command, cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    print(f'Recorder started in {workdir}: {args.models} models ({live} live, {geo} geo-blocked), {args.proxies} proxies, warming up for {args.warmup:g}s', file=sys.stderr)
+    try:
+        deadline = time.time() + args.warmup
+        status = None
+        while time.time() < deadline or status is None:
+            if recorder.poll() is not None:
+                raise SystemExit(f'Recorder exited with code {recorder.returncode}, see {workdir}/log.log')
+            time.sleep(1)
+            try:
+                status = fetchStatus(port)
+            except Exception:
+                status = None
+        startBytes, startDropped, startGaps = recorded(status)
+        startServed = site.counters.get('segment_bytes', 0)
+        startCpu, rss = usage(recorder.pid)
+        start = time.time()
+        peakRss = rss
+        while time.time() - start < args.seconds:
+            if recorder.poll() is not None:
+                raise SystemExit(f'Recorder exited with code {recorder.returncode}, see {workdir}/log.log')
+            time.sleep(1)
+            peakRss = max(peakRss, usage(recorder.pid)[1])
+        status = fetchStatus(port)
+        served = site.counters.get('segment_bytes', 0) - startServed
+        cpu, rss = usage(recorder.pid)
+        elapsed = time.time() - start
+    finally:
+        recorder.send_signal(signal.SIGINT)
+        try:
+            recorder.wait(40)
+        except subprocess.TimeoutExpired:
+            recorder.kill()
+
+    endBytes, endDropped, endGaps = recorded(status)
+    streams = len(status.get('recordings', []))
+    prober = status.get('prober', {})
+    ttfbs = [r['ttfb'] for r in status.get('recordings', []) if r.get('ttfb') is not None]
+    bandwidth = status.get('bandwidth', {})
+    expected = bandwidth['allocated'] if bandwidth.get('total') else streams * max(site.bitrates) * 1000
+    written = (endBytes - startBytes) / elapsed
+    report = {
+        'models': args.models,
+        'expected_streams': live + geo,
+        'streams': streams,
+        'probe_cycles': prober.get('cycles', 0),
+        'probe_cycle_avg_seconds': round(prober.get('avg_cycle_seconds', 0), 3),
+        'probe_cycle_last_seconds': round(prober.get('last_cycle_seconds', 0), 3),
+        'write_mbytes_per_second': round(written / 1048576, 2),
+        'served_mbytes_per_second': round(served / elapsed / 1048576, 2),
+        'expected_mbytes_per_second': round(expected / 8 / 1048576, 2),
+        'write_mismatch': bool(expected) and abs(written - expected / 8) > MISMATCH_SHARE * expected / 8,
+        'cpu_percent': round((cpu - startCpu) / elapsed * 100, 1),
+        'cpu_percent_per_stream': round((cpu - startCpu) / elapsed * 100 / max(streams, 1), 2),
+        'rss_mbytes': round(rss / 1048576, 1),
+        'peak_rss_mbytes': round(peakRss / 1048576, 1),
+        'rss_mbytes_per_stream': round(rss / 1048576 / max(streams, 1), 2),
+        'dropped_segments': endDropped - startDropped,
+        'gaps': endGaps - startGaps,
+        'ttfb_avg_seconds': round(sum(ttfbs) / len(ttfbs), 3) if ttfbs else None,
+        'route_cache': status.get('routes', {}),
+        'bandwidth': bandwidth,
+        'requests': dict(site.counters),
+    }
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f'Streams recording:    {streams} of {live + geo}')
+        print(f'Probe cycles:         {report["probe_cycles"]}, avg {report["probe_cycle_avg_seconds"]:.3f}s, last {report["probe_cycle_last_seconds"]:.3f}s')
+        print(f'Write throughput:     {report["write_mbytes_per_second"]:.2f} MB/s (recorded variants deliver {report["expected_mbytes_per_second"]:.2f} MB/s, origin served {report["served_mbytes_per_second"]:.2f} MB/s)')
+        if report['write_mismatch']:
+            print(f'WARNING: recorded bytes differ from the bitrate of the recorded variants by more than {MISMATCH_SHARE:.0%}', file=sys.stderr)
+        print(f'CPU:                  {report["cpu_percent"]:.1f}% ({report["cpu_percent_per_stream"]:.2f}% per stream)')
+        print(f'RSS:                  {report["rss_mbytes"]:.1f} MB, peak {report["peak_rss_mbytes"]:.1f} MB ({report["rss_mbytes_per_stream"]:.2f} MB per stream)')
+        print(f'Dropped segments:     {report["dropped_segments"]}, gaps: {report["gaps"]}')
+        if ttfbs:
+            print(f'Time to first byte:   {report["ttfb_avg_seconds"]:.3f}s average over {len(ttfbs)} recordings')
+        if report['route_cache']:
+            print(f'Route cache:          {report["route_cache"].get("hits", 0)} hits, {report["route_cache"].get("misses", 0)} misses, {report["route_cache"].get("negative_hits", 0)} checks skipped, {report["route_cache"].get("skipped_routes", 0)} blocked routes skipped')
+        if report['bandwidth'].get('total'):
+            print(f'Bandwidth:            {report["bandwidth"]["allocated"] / 1000000:.1f} of {report["bandwidth"]["total"] / 1000000:g} Mbit/s allocated, {report["bandwidth"]["downshifted"]} recordings downshifted, {report["bandwidth"]["switches"]} switches')
+        print(f'Origin requests:      {", ".join(f"{k} {v}" for k, v in sorted(site.counters.items()))}')
+    if args.keep:
+        print(f'Recorder files kept in {workdir}', file=sys.stderr)
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run ChaturbateRecorder.py against a local fake API, HLS origin and proxies and report its capacity.')
+    parser.add_argument('--models', type=int, default=200, help='models in the wishlist')
+    parser.add_argument('--live', type=float, default=0.1, help='share of models that are live')
+    parser.add_argument('--geo', type=float, default=0.02, help='share of models that are live but only reachable through a proxy of one region')
+    parser.add_argument('--proxies', type=int, default=3, help='fake proxy endpoints, spread over %d regions' % len(REGIONS))
+    parser.add_argument('--bitrates', default='800,2500', help='variant bitrates in kbit/s, comma separated')
+    parser.add_argument('--segment-seconds', type=float, default=2.0)
+    parser.add_argument('--budget', type=float, default=0, help='bandwidthBudget in Mbit/s; also gives every model a random priority from 0 to 2')
+    parser.add_argument('--mode', default='prefetch', choices=['streamlink', 'prefetch', 'async'], help='recorderMode to test')
+    parser.add_argument('--remux', action='store_true', help='record through ffmpeg (needs ffmpeg on PATH)')
+    parser.add_argument('--presence-mode', default='api', choices=['api', 'bulk'])
+    parser.add_argument('--workers', type=int, default=0, help='run a coordinator with this many worker processes instead of one recorder')
+    parser.add_argument('--check-interval', type=int, default=10)
+    parser.add_argument('--probe-concurrency', type=int, default=100)
+    parser.add_argument('--warmup', type=float, default=20, help='seconds to let recordings start before measuring')
+    parser.add_argument('--seconds', type=float, default=30, help='length of the measured window')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    parser.add_argument('--keep', action='store_true', help='keep the recordings and logs')
+    args = parser.parse_args()
+    run()
@@ -0,0 +1,263 @@
+import collections
+import os
+import shutil
+import threading
+import time
+from logWriter import log
+
+MIN_RECORDING_BYTES = 1024
+MARKER_SUFFIX = '.recording'
+
+
+def trim_padding(path, block=1048576):
+    with open(path, 'r+b') as f:
+        end = f.seek(0, os.SEEK_END)
+        while end > 0:
+            start = max(end - block, 0)
+            f.seek(start)
+            data = f.read(end - start).rstrip(b'\0')
+            if data:
+                end = start + len(data)
+                break
+            end = start
+        f.truncate(end)
+    return end
+
+
+def repair_recordings(directory, owner=''):
+    repaired = 0
+    for root, dirs, files in os.walk(directory):
+        for name in files:
+            if not name.endswith(MARKER_SUFFIX):
+                continue
+            marker = os.path.join(root, name)
+            path = marker[:-len(MARKER_SUFFIX)]
+            try:
+                with open(marker) as f:
+                    if f.read().strip() != owner:
+                        continue
+                if os.path.exists(path):
+                    size = trim_padding(path)
+                    if size <= MIN_RECORDING_BYTES:
+                        os.remove(path)
+                    log('recorder', f'Trimmed unfinished recording {path} to {size} bytes')
+                    repaired += 1
+                os.remove(marker)
+            except OSError as e:
+                log('recorder', f'Could not repair unfinished recording {path}: {e}', 'warning')
+    return repaired
+
+
+class WriteBudget:
+    def __init__(self, limit):
+        self.limit = max(limit, 1)
+        self.used = 0
+        self.cond = threading.Condition()
+        self.stats = {'buffered': 0, 'peak': 0, 'waits': 0, 'wait_seconds': 0.0}
+
+    def acquire(self, size):
+        with self.cond:
+            if self.used and self.used + size > self.limit:
+                start = time.time()
+                self.stats['waits'] += 1
+                while self.used and self.used + size > self.limit:
+                    self.cond.wait(1)
+                self.stats['wait_seconds'] += time.time() - start
+            self.used += size
+            self.stats['buffered'] = self.used
+            self.stats['peak'] = max(self.stats['peak'], self.used)
+
+    def release(self, size):
+        with self.cond:
+            self.used -= size
+            self.stats['buffered'] = self.used
+            self.cond.notify_all()
+
+
+class DiskGuard(threading.Thread):
+    def __init__(self, directory, min_free, interval=10):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.directory = directory
+        self.min_free = min_free
+        self.interval = interval
+        self.paused = False
+        self.free = None
+
+    def check(self):
+        self.free = shutil.disk_usage(self.directory).free
+        if not self.paused and self.free < self.min_free:
+            self.paused = True
+            log('recorder', f'Only {self.free / 1048576:.0f} MB free in {self.directory}, not starting new recordings', 'warning')
+        elif self.paused and self.free > self.min_free * 1.2:
+            self.paused = False
+            log('recorder', f'{self.free / 1048576:.0f} MB free in {self.directory} again, new recordings allowed')
+
+    def run(self):
+        while True:
+            try:
+                self.check()
+            except OSError as e:
+                log('recorder', f'Free space check failed: {e}', 'warning')
+            time.sleep(self.interval)
+
+
+class RecordingWriter(threading.Thread):
+    def __init__(self, model, next_path, budget, wrap=None, on_complete=None, preallocate=0, roll_size=0, roll_seconds=0, unlink_check=5, owner=''):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.model = model
+        self.next_path = next_path
+        self.budget = budget
+        self.wrap = wrap
+        self.on_complete = on_complete
+        self.preallocate = preallocate
+        self.roll_size = roll_size
+        self.roll_seconds = roll_seconds
+        self.unlink_check = unlink_check
+        self.owner = owner
+        self.cond = threading.Condition()
+        self.chunks = collections.deque()
+        self.closing = False
+        self.done = threading.Event()
+        self.error = None
+        self.is_unlinked = False
+        self.accepted = 0
+        self.stats = {'buffered': 0, 'files': 0, 'disk_write_seconds': 0.0}
+        self.open_file()
+
+    def open_file(self):
+        self.path = self.next_path()
+        self.file = open(self.path, 'wb')
+        if self.preallocate:
+            with open(self.path + MARKER_SUFFIX, 'w') as f:
+                f.write(self.owner)
+        self.sink = self.wrap(self.file) if self.wrap else self.file
+        self.allocated = 0
+        self.file_bytes = 0
+        self.file_started = time.time()
+        self.next_unlink_check = 0
+        self.stats['files'] += 1
+
+    def write(self, data):
+        if self.error:
+            raise self.error
+        if isinstance(data, bytearray) or (isinstance(data, memoryview) and not data.readonly):
+            data = bytes(data)
+        self.budget.acquire(len(data))
+        with self.cond:
+            self.chunks.append(data)
+            self.stats['buffered'] += len(data)
+            self.accepted += len(data)
+            self.cond.notify()
+        return len(data)
+
+    def roll(self):
+        with self.cond:
+            self.chunks.append(None)
+            self.cond.notify()
+
+    def tell(self):
+        return self.accepted
+
+    def unlinked(self):
+        return self.is_unlinked
+
+    def failed(self):
+        if self.error:
+            return True
+        alive = getattr(self.sink, 'alive', None)
+        return bool(alive and not alive())
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.chunks and not self.closing:
+                    self.cond.wait()
+                if not self.chunks:
+                    break
+                data = self.chunks.popleft()
+                if data is not None:
+                    self.stats['buffered'] -= len(data)
+            if data is None:
+                self.roll_file()
+                continue
+            self.process(data)
+            self.budget.release(len(data))
+        self.finish()
+        self.done.set()
+
+    def process(self, data):
+        try:
+            if not (self.error or self.is_unlinked):
+                self.write_chunk(data)
+        except Exception as e:
+            self.error = IOError(f'Write to {self.path} failed: {e}')
+            log('recorder', f'[{self.model}] {self.error}', 'error')
+
+    def roll_file(self):
+        try:
+            if self.file_bytes and not (self.error or self.is_unlinked):
+                self.finish_file()
+                self.open_file()
+        except Exception as e:
+            self.error = IOError(f'Rolling {self.path} failed: {e}')
+            log('recorder', f'[{self.model}] {self.error}', 'error')
+
+    def finish(self):
+        try:
+            self.finish_file()
+        except Exception as e:
+            log('recorder', f'[{self.model}] Closing {self.path} failed: {e}', 'error')
+
+    def write_chunk(self, data):
+        now = time.time()
+        if self.file_bytes and ((self.roll_size and self.file_bytes >= self.roll_size) or (self.roll_seconds and now - self.file_started >= self.roll_seconds)):
+            self.finish_file()
+            self.open_file()
+        if now >= self.next_unlink_check:
+            if os.fstat(self.file.fileno()).st_nlink == 0:
+                self.is_unlinked = True
+                return
+            self.next_unlink_check = now + self.unlink_check
+        self.sink.write(data)
+        self.file_bytes += len(data)
+        self.stats['disk_write_seconds'] += time.time() - now
+        if self.preallocate and self.file_bytes + self.preallocate // 2 > self.allocated:
+            self.allocate()
+
+    def allocate(self):
+        if not hasattr(os, 'posix_fallocate'):
+            self.preallocate = 0
+            return
+        try:
+            os.posix_fallocate(self.file.fileno(), self.allocated, self.preallocate)
+            self.allocated += self.preallocate
+        except OSError:
+            self.preallocate = 0
+
+    def finish_file(self):
+        if self.sink is not self.file:
+            self.sink.close()
+        self.file.flush()
+        end = os.lseek(self.file.fileno(), 0, os.SEEK_CUR)
+        if self.allocated:
+            self.file.truncate(end)
+        self.file.close()
+        try:
+            os.remove(self.path + MARKER_SUFFIX)
+        except OSError:
+            pass
+        if end <= MIN_RECORDING_BYTES:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+        elif self.on_complete and not self.is_unlinked:
+            self.on_complete(self.path)
+
+    def close(self):
+        with self.cond:
+            self.closing = True
+            self.cond.notify()
+        self.done.wait()
@@ -0,0 +1,75 @@
+import os
+import subprocess
+import threading
+import time
+from logWriter import log
+
+STALL_SECONDS = 0.5
+CLOSE_TIMEOUT = 30
+
+
+class FFmpegRemuxer:
+    def __init__(self, output, name, ffmpeg='ffmpeg'):
+        self.output = output
+        self.name = name
+        self.proc = subprocess.Popen(
+            [ffmpeg, '-hide_banner', '-loglevel', 'error', '-fflags', '+discardcorrupt',
+             '-f', 'mpegts', '-i', 'pipe:0', '-map', '0', '-c', 'copy',
+             '-f', 'mp4', '-movflags', '+frag_keyframe+empty_moov+default_base_moof', 'pipe:1'],
+            stdin=subprocess.PIPE, stdout=output, stderr=subprocess.PIPE)
+        self.stats = {
+            'remux_cpu_seconds': 0.0,
+            'pipe_wait_seconds': 0.0,
+            'pipe_stalls': 0,
+        }
+        self.clock_ticks = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+        threading.Thread(target=self.read_errors, daemon=True).start()
+
+    def read_errors(self):
+        for line in self.proc.stderr:
+            log('recorder', f'[{self.name}] ffmpeg: {line.decode(errors="replace").strip()}', 'warning')
+
+    def write(self, data):
+        if self.proc.poll() is not None:
+            raise IOError(f'ffmpeg exited with code {self.proc.returncode}')
+        start = time.time()
+        self.proc.stdin.write(data)
+        waited = time.time() - start
+        self.stats['pipe_wait_seconds'] += waited
+        if waited >= STALL_SECONDS:
+            self.stats['pipe_stalls'] += 1
+        return len(data)
+
+    def alive(self):
+        return self.proc.poll() is None
+
+    def cpu_seconds(self):
+        try:
+            with open(f'/proc/{self.proc.pid}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            self.stats['remux_cpu_seconds'] = (int(fields[11]) + int(fields[12])) / self.clock_ticks
+        except (OSError, IndexError, ValueError):
+            pass
+        return self.stats['remux_cpu_seconds']
+
+    def close(self):
+        try:
+            self.proc.stdin.close()
+        except OSError:
+            pass
+        deadline = time.time() + CLOSE_TIMEOUT
+        while True:
+            self.cpu_seconds()
+            try:
+                self.proc.wait(timeout=0.1)
+                break
+            except subprocess.TimeoutExpired:
+                if time.time() >= deadline:
+                    log('recorder', f'[{self.name}] ffmpeg did not exit within {CLOSE_TIMEOUT}s, killing it', 'error')
+                    self.proc.kill()
+                    self.proc.wait()
+                    break
+        if self.proc.returncode:
+            log('recorder', f'[{self.name}] ffmpeg remux exited with code {self.proc.returncode}', 'error')
+        log('recorder', f'[{self.name}] Remux finished: {self.stats["remux_cpu_seconds"]:.1f}s cpu, {self.stats["pipe_wait_seconds"]:.1f}s waiting on the pipe ({self.stats["pipe_stalls"]} stalls)')
+        return self.proc.returncode
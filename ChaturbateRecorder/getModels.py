@@ -1,68 +1,59 @@
-import gevent, requests, sys, re, configparser
-from threading import Thread
-from queue import Queue
-from bs4 import BeautifulSoup
+import asyncio, sys, re, time, configparser
+import aiohttp
+import lxml.html
+from onlineProber import BASE_URL, LISTING_URL, parse_listing, last_page
 
 Config = configparser.ConfigParser()
 Config.read(sys.path[0] + "/config.conf")
-genders = re.sub(' ', '', Config.get('settings', 'genders')).split(",")
-lastPage = {'female': 100, 'couple': 100, 'trans': 100, 'male': 100}
+genders = re.sub(' ', '', Config.get('settings', 'genders')).lower().split(",")
+concurrency = Config.getint('settings', 'probeConcurrency', fallback=100)
+baseUrl = Config.get('settings', 'siteUrl', fallback=BASE_URL).rstrip('/')
+seen = set()
 
 
-def getOnlineModels():
-    global lastPage
-    global q
-    global online
-    if not q.empty():
-        args = q.get()
-        page = args[0]
-        gender = args[1]
-        if page < lastPage[gender]:
-            attempt = 1
-            while attempt <= 3:
-                try:
-                    timeout = gevent.Timeout(8)
-                    timeout.start()
-                    URL = "https://chaturbate.com/{gender}-cams/?page={page}".format(gender=gender.lower(), page=page)
-                    result = requests.request('GET', URL)
-                    result = result.text
-                    soup = BeautifulSoup(result, 'lxml')
-                    if lastPage[gender] == 100:
-                        lastPage[gender] = int(soup.findAll('a', {'class': 'endless_page_link'})[-2].string)
-                    if int(soup.findAll('li', {'class': 'active'})[1].string) == page:
-                        LIST = soup.findAll('ul', {'class': 'list'})[0]
-                        models = LIST.find_all('div', {'class': 'title'})
-                        for model in models:
-                            online.append(model.find_all('a', href=True)[0].string.lower()[1:])
-                    break
-                except gevent.Timeout:
-                    attempt = attempt + 1
-                    if attempt > 3:
-                        break
+async def fetchPage(session, semaphore, gender, page):
+    async with semaphore:
+        for attempt in range(3):
+            try:
+                async with session.get(LISTING_URL.format(base=baseUrl, gender=gender, page=page), timeout=aiohttp.ClientTimeout(total=8)) as resp:
+                    return lxml.html.fromstring(await resp.read())
+            except Exception:
+                continue
+    return None
 
 
-def getModels():
-    workers = []
-    for gender in genders:
-        if gender == 'couple':
-            for i in range(1, 3):
-                q.put([i, gender])
+def emit(rooms):
+    new = rooms - seen
+    if new:
+        seen.update(new)
+        sys.stdout.write(''.join(model + '\n' for model in new))
+        sys.stdout.flush()
+    return len(rooms)
+
+
+async def crawlGender(session, semaphore, gender):
+    start = time.time()
+    first = await fetchPage(session, semaphore, gender, 1)
+    if first is None:
+        print('{}: could not load the first page'.format(gender), file=sys.stderr)
+        return
+    found = emit(parse_listing(first))
+    pages = last_page(first)
+    failed = 0
+    for task in asyncio.as_completed([fetchPage(session, semaphore, gender, page) for page in range(2, pages + 1)]):
+        doc = await task
+        if doc is None:
+            failed += 1
         else:
-            for i in range(1, 30):
-                q.put([i, gender])
-    while not q.empty():
-        for i in range(10):
-            t = Thread(target=getOnlineModels)
-            workers.append(t)
-            t.start()
-        for t in workers:
-            t.join()
+            found += emit(parse_listing(doc))
+    print('{}: {} rooms from {} pages ({} failed) in {:.2f}s'.format(gender, found, pages, failed, time.time() - start), file=sys.stderr)
+
+
+async def getModels():
+    connector = aiohttp.TCPConnector(limit=concurrency, ttl_dns_cache=300)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        semaphore = asyncio.Semaphore(concurrency)
+        await asyncio.gather(*(crawlGender(session, semaphore, gender) for gender in genders if gender))
 
 if __name__ == '__main__':
-    q = Queue()
-    online = []
-    workers = []
-    getModels()
-    online = list(set(online))
-    for model in online:
-        print(model)
+    asyncio.run(getModels())
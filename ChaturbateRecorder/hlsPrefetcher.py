@@ -0,0 +1,267 @@
+import re
+import threading
+import time
+import requests
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin
+
+ATTRIBUTE_RE = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+
+def parse_attributes(text):
+    return {key: value.strip('"') for key, value in ATTRIBUTE_RE.findall(text)}
+
+
+def parse_master_playlist(text, base_url):
+    variants = []
+    attributes = None
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith('#EXT-X-STREAM-INF:'):
+            attributes = parse_attributes(line.split(':', 1)[1])
+        elif line and not line.startswith('#') and attributes is not None:
+            variants.append({
+                'bandwidth': int(attributes.get('BANDWIDTH', 0)),
+                'resolution': attributes.get('RESOLUTION', ''),
+                'url': urljoin(base_url, line),
+            })
+            attributes = None
+    variants.sort(key=lambda variant: variant['bandwidth'])
+    return variants
+
+
+def parse_media_playlist(text, base_url):
+    sequence = 0
+    target_duration = 2.0
+    duration = None
+    ended = False
+    segments = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith('#EXT-X-MEDIA-SEQUENCE:'):
+            sequence = int(line.split(':', 1)[1])
+        elif line.startswith('#EXT-X-TARGETDURATION:'):
+            target_duration = float(line.split(':', 1)[1])
+        elif line.startswith('#EXTINF:'):
+            duration = float(line[8:].split(',')[0])
+        elif line.startswith('#EXT-X-ENDLIST'):
+            ended = True
+        elif line and not line.startswith('#'):
+            segments.append((sequence + len(segments), urljoin(base_url, line), duration or target_duration))
+            duration = None
+    return {'target_duration': target_duration, 'segments': segments, 'ended': ended}
+
+
+class HLSPrefetcher:
+    def __init__(self, url, proxy=None, workers=4, prefetch_depth=6, live_edge=3, timeout=10, stall_timeout=30, session=None, choose_variant=None):
+        self.url = url
+        self.choose_variant = choose_variant
+        self.workers = workers
+        self.prefetch_depth = max(prefetch_depth, 1)
+        self.live_edge = max(live_edge, 1)
+        self.timeout = timeout
+        self.stall_timeout = stall_timeout
+        self.session = session
+        if session is None:
+            self.session = requests.Session()
+            if proxy:
+                self.session.proxies = {'http': proxy, 'https': proxy}
+
+        self.cond = threading.Condition()
+        self.known = OrderedDict()
+        self.results = {}
+        self.next_seq = None
+        self.queued_seq = None
+        self.last_seq = None
+        self.newest = None
+        self.newest_at = 0
+        self.target_duration = 2.0
+        self.closed = False
+        self.ended = False
+        self.error = None
+        self.last_progress = time.time()
+        self.current = memoryview(b'')
+        self.offset = 0
+        self.executor = None
+        self.variants = []
+        self.switched = False
+        self.roll_seq = None
+        self.rolled = False
+        self.shift = 0
+        self.stats = {
+            'segments': 0,
+            'dropped': 0,
+            'fetch_latency': 0.0,
+            'lag_seconds': 0.0,
+            'variant_bandwidth': 0,
+            'variant_switches': 0,
+        }
+
+    def open(self):
+        response = self.session.get(self.url, timeout=self.timeout)
+        response.raise_for_status()
+        if '#EXT-X-STREAM-INF' in response.text:
+            self.variants = parse_master_playlist(response.text, response.url)
+            if not self.variants:
+                raise IOError('No variants found in master playlist')
+            index = self.choose_variant(self.variants) if self.choose_variant else -1
+            self.media_url = self.variants[index]['url']
+            self.stats['variant_bandwidth'] = self.variants[index]['bandwidth']
+            playlist = self.fetch_playlist()
+        else:
+            self.media_url = response.url
+            playlist = parse_media_playlist(response.text, response.url)
+
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        self.schedule(playlist)
+        threading.Thread(target=self.poll, daemon=True).start()
+        return self
+
+    def fetch_playlist(self):
+        media_url = self.media_url
+        response = self.session.get(media_url, timeout=self.timeout)
+        response.raise_for_status()
+        playlist = parse_media_playlist(response.text, response.url)
+        playlist['media_url'] = media_url
+        return playlist
+
+    def switch(self, index):
+        with self.cond:
+            if not self.variants or self.variants[index]['url'] == self.media_url:
+                return
+            self.media_url = self.variants[index]['url']
+            self.stats['variant_bandwidth'] = self.variants[index]['bandwidth']
+            self.stats['variant_switches'] += 1
+            self.known.clear()
+            self.switched = True
+            self.roll_seq = self.queued_seq + 1 if self.queued_seq is not None else None
+
+    def poll(self):
+        failures = 0
+        while not (self.closed or self.ended):
+            time.sleep(max(self.target_duration / 2, 0.5))
+            try:
+                self.schedule(self.fetch_playlist())
+                failures = 0
+            except Exception as e:
+                failures += 1
+                if failures >= 5:
+                    with self.cond:
+                        self.error = IOError(f'Playlist refresh failed: {e}')
+                        self.cond.notify_all()
+                    return
+
+    def schedule(self, playlist):
+        segments = playlist['segments']
+        with self.cond:
+            self.target_duration = playlist['target_duration']
+            if not segments:
+                return
+            if self.next_seq is None:
+                self.next_seq = segments[max(len(segments) - self.live_edge, 0)][0]
+                self.queued_seq = self.next_seq - 1
+            elif self.switched and playlist.get('media_url') == self.media_url:
+                self.switched = False
+                if not segments[0][0] <= self.next_seq <= segments[-1][0] + 1:
+                    shift = segments[-1][0] - self.newest - round((time.time() - self.newest_at) / self.target_duration)
+                    self.shift += shift
+                    self.results = {seq + shift: data for seq, data in self.results.items()}
+                    self.next_seq += shift
+                    self.queued_seq += shift
+                    if self.roll_seq is not None:
+                        self.roll_seq += shift
+
+            newest = self.newest = segments[-1][0]
+            self.newest_at = time.time()
+            for seq, url, duration in segments:
+                if seq > self.queued_seq and seq not in self.known:
+                    self.known[seq] = url
+
+            if newest - self.next_seq + 1 > self.live_edge + self.prefetch_depth:
+                skip_to = newest - self.live_edge + 1
+                for seq in range(self.next_seq, skip_to):
+                    self.known.pop(seq, None)
+                    self.results.pop(seq, None)
+                self.stats['dropped'] += skip_to - self.next_seq
+                self.next_seq = skip_to
+                self.queued_seq = max(self.queued_seq, skip_to - 1)
+
+            self.stats['lag_seconds'] = (newest - self.next_seq + 1) * self.target_duration
+            if playlist['ended']:
+                self.ended = True
+                self.last_seq = newest
+            self.fill()
+            self.cond.notify_all()
+
+    def fill(self):
+        while self.known:
+            seq = next(iter(self.known))
+            if seq >= self.next_seq + self.prefetch_depth:
+                break
+            url = self.known.pop(seq)
+            if seq <= self.queued_seq:
+                continue
+            self.queued_seq = seq
+            self.executor.submit(self.fetch_segment, seq, url, self.shift)
+
+    def fetch_segment(self, seq, url, shift=0):
+        data = None
+        for attempt in range(2):
+            if self.closed:
+                return
+            start = time.time()
+            try:
+                response = self.session.get(url, timeout=self.timeout)
+                response.raise_for_status()
+                data = response.content
+                latency = time.time() - start
+                self.stats['fetch_latency'] += 0.2 * (latency - self.stats['fetch_latency'])
+                break
+            except Exception:
+                continue
+        with self.cond:
+            seq += self.shift - shift
+            if seq >= self.next_seq:
+                self.results[seq] = data
+                self.cond.notify_all()
+
+    def read(self, size=-1):
+        while self.offset >= len(self.current):
+            with self.cond:
+                while self.next_seq not in self.results:
+                    if self.closed:
+                        return b''
+                    if self.error:
+                        raise self.error
+                    if self.ended and self.next_seq is not None and self.next_seq > self.last_seq:
+                        return b''
+                    if time.time() - self.last_progress > self.stall_timeout:
+                        raise IOError('HLS stream stalled')
+                    self.cond.wait(1)
+                data = self.results.pop(self.next_seq)
+                if self.roll_seq is not None and self.next_seq >= self.roll_seq:
+                    self.roll_seq = None
+                    self.rolled = True
+                self.next_seq += 1
+                self.last_progress = time.time()
+                self.fill()
+            if data is None:
+                self.stats['dropped'] += 1
+                continue
+            self.stats['segments'] += 1
+            self.current = memoryview(data)
+            self.offset = 0
+
+        if size < 0:
+            size = len(self.current) - self.offset
+        chunk = self.current[self.offset:self.offset + size]
+        self.offset += len(chunk)
+        return chunk
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
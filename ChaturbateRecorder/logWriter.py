@@ -0,0 +1,133 @@
+import atexit
+import datetime
+import json
+import os
+import queue
+import threading
+import time
+
+LEVELS = {'debug': 10, 'info': 20, 'warning': 30, 'error': 40}
+
+
+class LogWriter(threading.Thread):
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.queue = queue.SimpleQueue()
+        self.files = {
+            'model_check': 'model_check.log',
+            'recorder': 'log.log',
+            'proxy': 'proxy_debug.log',
+        }
+        self.default_level = LEVELS['info']
+        self.levels = {}
+        self.console = set()
+        self.format = 'text'
+        self.tag = ''
+        self.max_bytes = 10 * 1024 * 1024
+        self.backups = 3
+        self.flush_interval = 1.0
+        self.batch_size = 1000
+        self.dropped = 0
+
+    def configure(self, level='info', levels='', console='', format='text', max_size=10, backups=3):
+        self.default_level = LEVELS.get(level.strip().lower(), LEVELS['info'])
+        self.levels = {}
+        for entry in levels.split(','):
+            if ':' in entry:
+                module, module_level = entry.split(':', 1)
+                self.levels[module.strip()] = LEVELS.get(module_level.strip().lower(), self.default_level)
+        self.console = {module.strip() for module in console.split(',') if module.strip()}
+        self.format = format.strip().lower() or 'text'
+        self.max_bytes = int(max_size * 1024 * 1024)
+        self.backups = backups
+
+    def log(self, module, message, level='info'):
+        if LEVELS[level] < self.levels.get(module, self.default_level):
+            return
+        self.queue.put((time.time(), module, level, message))
+
+    def flush(self, timeout=5):
+        if not self.is_alive():
+            return
+        done = threading.Event()
+        self.queue.put(done)
+        done.wait(timeout)
+
+    def run(self):
+        batch = []
+        waiters = []
+        deadline = time.time() + self.flush_interval
+        while True:
+            timeout = deadline - time.time()
+            if timeout > 0 and len(batch) < self.batch_size and not waiters:
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    continue
+                if isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    batch.append(item)
+                continue
+            if batch:
+                self.write(batch)
+                batch = []
+            for waiter in waiters:
+                waiter.set()
+            waiters = []
+            deadline = time.time() + self.flush_interval
+
+    def format_line(self, timestamp, module, level, message):
+        if self.format == 'json':
+            return json.dumps({'ts': round(timestamp, 3), 'module': module, 'level': level, 'msg': message}, ensure_ascii=False) + '\n'
+        stamp = datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+        if level == 'info':
+            return f'[{stamp}] {message}\n'
+        return f'[{stamp}] {level.upper()}: {message}\n'
+
+    def write(self, batch):
+        grouped = {}
+        for timestamp, module, level, message in batch:
+            line = self.format_line(timestamp, module, level, message)
+            grouped.setdefault(self.path(module), []).append(line)
+            if module in self.console:
+                print(line, end='')
+        for path, lines in grouped.items():
+            data = ''.join(lines)
+            try:
+                self.rotate(path, len(data))
+                with open(path, 'a', encoding='utf-8') as f:
+                    f.write(data)
+            except Exception:
+                self.dropped += len(lines)
+
+    def path(self, module):
+        path = self.files.get(module, f'{module}.log')
+        if self.tag:
+            root, extension = os.path.splitext(path)
+            path = f'{root}.{self.tag}{extension}'
+        return path
+
+    def rotate(self, path, incoming):
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        if not self.max_bytes or size + incoming <= self.max_bytes:
+            return
+        for index in range(self.backups - 1, 0, -1):
+            if os.path.exists(f'{path}.{index}'):
+                os.replace(f'{path}.{index}', f'{path}.{index + 1}')
+        if self.backups:
+            os.replace(path, f'{path}.1')
+        else:
+            os.remove(path)
+
+
+writer = LogWriter()
+atexit.register(writer.flush)
+
+
+def log(module, message, level='info'):
+    writer.log(module, message, level)
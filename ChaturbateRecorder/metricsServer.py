@@ -0,0 +1,172 @@
+import json
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self):
+        cumulative = []
+        total = 0
+        for bound, count in zip(list(self.buckets) + ['+Inf'], self.counts):
+            total += count
+            cumulative.append([bound, total])
+        return {'buckets': cumulative, 'sum': self.sum, 'count': self.count}
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_metrics(status):
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f'# HELP cbrec_{name} {help_text}')
+        lines.append(f'# TYPE cbrec_{name} {kind}')
+        for labels, value in samples:
+            label_text = ','.join(f'{key}="{escape_label(val)}"' for key, val in labels.items())
+            lines.append(f'cbrec_{name}{{{label_text}}} {value}' if label_text else f'cbrec_{name} {value}')
+
+    def histogram(name, help_text, snapshot):
+        lines.append(f'# HELP cbrec_{name} {help_text}')
+        lines.append(f'# TYPE cbrec_{name} histogram')
+        for bound, count in snapshot['buckets']:
+            lines.append(f'cbrec_{name}_bucket{{le="{bound}"}} {count}')
+        lines.append(f'cbrec_{name}_sum {snapshot["sum"]}')
+        lines.append(f'cbrec_{name}_count {snapshot["count"]}')
+
+    recordings = status.get('recordings', [])
+    metric('wanted_models', 'gauge', 'Models in the wishlist', [({}, status.get('wanted', 0))])
+    metric('recordings_active', 'gauge', 'Recordings in progress', [({}, len(recordings))])
+    metric('models', 'gauge', 'Wishlist models by registry state', [({'state': state}, count) for state, count in status.get('states', {}).items()])
+    metric('recording_bytes_total', 'counter', 'Bytes written per recording', [({'model': r['model']}, r['bytes']) for r in recordings])
+    metric('recording_throughput_bytes', 'gauge', 'Write throughput per recording in bytes/s', [({'model': r['model']}, round(r['throughput'], 1)) for r in recordings])
+    metric('recording_gaps_total', 'counter', 'Stream interruptions resumed per recording', [({'model': r['model']}, r['gaps']) for r in recordings])
+    metric('remux_cpu_seconds_total', 'counter', 'CPU time used by the ffmpeg remux process per recording', [({'model': r['model']}, round(r['remux_cpu_seconds'], 2)) for r in recordings if 'remux_cpu_seconds' in r])
+    metric('remux_pipe_wait_seconds_total', 'counter', 'Time spent blocked writing into the ffmpeg pipe per recording', [({'model': r['model']}, round(r['pipe_wait_seconds'], 2)) for r in recordings if 'pipe_wait_seconds' in r])
+    metric('remux_pipe_stalls_total', 'counter', 'Pipe writes that blocked for 0.5s or longer per recording', [({'model': r['model']}, r['pipe_stalls']) for r in recordings if 'pipe_stalls' in r])
+    metric('recording_dropped_segments_total', 'counter', 'Segments dropped per recording', [({'model': r['model']}, r['dropped']) for r in recordings if r.get('dropped') is not None])
+
+    if 'workers' in status:
+        metric('cluster_workers', 'gauge', 'Workers with a fresh heartbeat', [({}, sum(1 for worker in status['workers'] if worker['alive']))])
+        metric('cluster_worker_recordings', 'gauge', 'Recordings in progress per worker', [({'worker': worker['id']}, worker['recordings']) for worker in status['workers'] if worker['alive']])
+        metric('cluster_worker_restarts_total', 'counter', 'Local workers restarted by the coordinator', [({}, status.get('restarts', 0))])
+
+    recorder = status.get('recorder', {})
+    if recorder:
+        metric('recorder_loop_streams', 'gauge', 'Recordings running on each recorder event loop', [({'loop': index}, count) for index, count in enumerate(recorder.get('streams', []))])
+        metric('recorder_streams_finished_total', 'counter', 'Recordings finished on the recorder event loops by result', [({'result': 'ok'}, recorder.get('finished', 0) - recorder.get('failed', 0)), ({'result': 'failed'}, recorder.get('failed', 0))])
+
+    bandwidth = status.get('bandwidth', {})
+    metric('bandwidth_budget_bits', 'gauge', 'Configured total recording bandwidth in bits/s (0 = unlimited)', [({}, bandwidth.get('total', 0))])
+    metric('bandwidth_allocated_bits', 'gauge', 'Bandwidth of the stream variants currently recorded in bits/s', [({}, bandwidth.get('allocated', 0))])
+    metric('bandwidth_downshifted_recordings', 'gauge', 'Recordings running below their best variant to stay within the budget', [({}, bandwidth.get('downshifted', 0))])
+    metric('bandwidth_variant_switches_total', 'counter', 'Variant switches made by the bandwidth budget by direction', [({'direction': 'down'}, bandwidth.get('downshifts', 0)), ({'direction': 'up'}, bandwidth.get('upshifts', 0))])
+    metric('recording_variant_bandwidth_bits', 'gauge', 'Bandwidth of the variant recorded per recording in bits/s', [({'model': r['model']}, r['variant_bandwidth']) for r in recordings if r.get('variant_bandwidth')])
+
+    prober = status.get('prober', {})
+    metric('probe_cycles_total', 'counter', 'Completed probe cycles', [({}, prober.get('cycles', 0))])
+    metric('probe_cycle_seconds', 'gauge', 'Duration of the last probe cycle', [({}, prober.get('last_cycle_seconds', 0))])
+    metric('probe_models', 'gauge', 'Models probed in the last cycle', [({}, prober.get('last_probed', 0))])
+    metric('probe_online_models', 'gauge', 'Models found online in the last cycle', [({}, prober.get('last_online', 0))])
+    schedule = status.get('schedule', {})
+    metric('probe_scheduled_models', 'gauge', 'Models waiting for their next scheduled probe', [({}, schedule.get('scheduled', 0))])
+    metric('probe_backlog_models', 'gauge', 'Models due for a probe but held back by the rate budget', [({}, schedule.get('backlog', 0))])
+    metric('probe_deferred_total', 'counter', 'Scheduled probes skipped because the model was busy', [({}, schedule.get('deferred', 0))])
+    if 'latency' in prober:
+        histogram('probe_latency_seconds', 'Latency of chatvideocontext requests', prober['latency'])
+
+    proxy = status.get('proxy', {})
+    metric('proxy_pool_size', 'gauge', 'Healthy proxies available', [({}, proxy.get('working', 0))])
+    metric('proxy_requests_total', 'counter', 'Proxy requests from recorders and prober', [({}, proxy.get('requests', 0))])
+    metric('proxy_hits_total', 'counter', 'Proxy requests that returned a proxy', [({}, proxy.get('hits', 0))])
+    metric('proxy_refresh_seconds', 'gauge', 'Duration of the last proxy pool refresh', [({}, proxy.get('last_refresh_seconds', 0))])
+    metric('proxy_pool_region_size', 'gauge', 'Healthy proxies available per exit region', [({'region': region}, count) for region, count in proxy.get('regions', {}).items()])
+    metric('proxy_region_selections_total', 'counter', 'Region-targeted proxy selections by result', [({'result': 'preferred'}, proxy.get('region_hits', 0)), ({'result': 'none_allowed'}, proxy.get('region_misses', 0))])
+
+    sessions = status.get('sessions', {})
+    metric('http_session_routes', 'gauge', 'Routes (direct or a proxy) with a pooled HTTP session', [({}, sessions.get('routes', 0))])
+    metric('http_sessions_created_total', 'counter', 'Pooled HTTP sessions created', [({}, sessions.get('sessions_created', 0))])
+    metric('http_session_reuses_total', 'counter', 'Probes and stream opens served by an existing session', [({}, sessions.get('session_reuses', 0))])
+    metric('http_session_setup_cpu_seconds_total', 'counter', 'CPU time spent creating HTTP and streamlink sessions', [({}, round(sessions.get('setup_cpu_seconds', 0), 4))])
+    if 'ttfb' in sessions:
+        histogram('recording_ttfb_seconds', 'Time from starting a recording to its first byte', sessions['ttfb'])
+
+    routes = status.get('routes', {})
+    metric('route_cache_lookups_total', 'counter', 'Route cache lookups by result', [({'result': 'hit'}, routes.get('hits', 0)), ({'result': 'miss'}, routes.get('misses', 0))])
+    metric('route_cache_negative_hits_total', 'counter', 'Online checks skipped because the model was offline or unreachable moments ago', [({}, routes.get('negative_hits', 0))])
+    metric('route_cache_skipped_routes_total', 'counter', 'Direct or proxy attempts skipped because the route is geo-blocked for the model', [({}, routes.get('skipped_routes', 0))])
+    metric('route_cache_denials_total', 'counter', 'Region denials received from the chatvideocontext api', [({}, routes.get('denials', 0))])
+    metric('route_cache_entries', 'gauge', 'Remembered working routes for online checks and stream opens', [({}, routes.get('entries', 0))])
+    metric('route_cache_denied_direct', 'gauge', 'Models known to be geo-blocked on the direct connection', [({}, routes.get('denied_direct', 0))])
+
+    disk = status.get('disk', {})
+    metric('disk_free_bytes', 'gauge', 'Free space in the save directory', [({}, disk['free'])] if disk.get('free') is not None else [])
+    metric('disk_paused', 'gauge', '1 while new recordings are paused for lack of free space', [({}, int(disk.get('paused', False)))])
+    metric('write_buffer_bytes', 'gauge', 'Recording data waiting to be written to disk', [({}, disk.get('buffered', 0))])
+    metric('write_buffer_waits_total', 'counter', 'Times a recording waited because the write buffer budget was full', [({}, disk.get('waits', 0))])
+
+    postprocessing = status.get('postprocessing', {})
+    metric('postprocessing_queue_depth', 'gauge', 'Recordings waiting for post-processing', [({}, postprocessing.get('queue_depth', 0))])
+    if 'duration' in postprocessing:
+        metric('postprocessing_running', 'gauge', 'Post-processing jobs running', [({}, postprocessing['running'])])
+        metric('postprocessing_jobs_total', 'counter', 'Finished post-processing jobs by result', [({'result': result}, postprocessing[result]) for result in ('completed', 'failed', 'retried')])
+        histogram('postprocessing_duration_seconds', 'Run time of post-processing jobs', postprocessing['duration'])
+        histogram('postprocessing_wait_seconds', 'Time post-processing jobs spent queued', postprocessing['wait'])
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        try:
+            status = self.server.collect()
+            if self.path.startswith('/metrics'):
+                body = render_metrics(status).encode()
+                content_type = 'text/plain; version=0.0.4'
+            elif self.path.startswith('/status'):
+                body = json.dumps(status, default=str).encode()
+                content_type = 'application/json'
+            else:
+                self.send_error(404)
+                return
+        except Exception as e:
+            self.send_error(500, str(e))
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer(threading.Thread):
+    def __init__(self, collect, port, host='127.0.0.1'):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.httpd = ThreadingHTTPServer((host, port), MetricsHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.collect = collect
+
+    def run(self):
+        self.httpd.serve_forever()
@@ -0,0 +1,185 @@
+import os
+import threading
+import time
+
+IDLE = 'idle'
+PROBING = 'probing'
+RECORDING = 'recording'
+POSTPROCESSING = 'post-processing'
+
+TRANSITIONS = {
+    IDLE: {PROBING},
+    PROBING: {IDLE, RECORDING},
+    RECORDING: {IDLE, POSTPROCESSING},
+    POSTPROCESSING: {IDLE, PROBING},
+}
+
+
+class ModelEntry:
+    __slots__ = ('name', 'state', 'thread', 'wanted', 'since', 'priority', 'jobs')
+
+    def __init__(self, name, priority=0):
+        self.name = name
+        self.priority = priority
+        self.state = IDLE
+        self.thread = None
+        self.wanted = True
+        self.since = time.time()
+        self.jobs = 0
+
+
+class ModelRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.models = {}
+        self.by_state = {state: set() for state in TRANSITIONS}
+        self.wishlist_mtime = None
+        self.wanted_count = 0
+        self.repeated = []
+
+    def reload_wishlist(self, path):
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return [], []
+        if mtime == self.wishlist_mtime:
+            return [], []
+
+        wanted = {}
+        repeated = []
+        with open(path, 'r') as f:
+            for line in f:
+                parts = line.split()
+                if not parts:
+                    continue
+                name = parts[0].lower()
+                priority = int(parts[1]) if len(parts) > 1 and parts[1].lstrip('-').isdigit() else 0
+                if name in wanted:
+                    repeated.append(name)
+                else:
+                    wanted[name] = priority
+
+        added = []
+        removed = []
+        with self.lock:
+            self.wishlist_mtime = mtime
+            self.repeated = repeated
+            self.wanted_count = len(wanted)
+            for name, priority in wanted.items():
+                entry = self.models.get(name)
+                if entry is None:
+                    entry = ModelEntry(name, priority)
+                    self.models[name] = entry
+                    self.by_state[IDLE].add(name)
+                    added.append(name)
+                elif not entry.wanted:
+                    entry.wanted = True
+                    added.append(name)
+                entry.priority = priority
+            for name, entry in list(self.models.items()):
+                if entry.wanted and name not in wanted:
+                    entry.wanted = False
+                    removed.append(name)
+                    if entry.state == IDLE:
+                        self._remove(name)
+                    elif entry.state in (PROBING, RECORDING) and entry.thread:
+                        entry.thread.stop()
+        return added, removed
+
+    def _remove(self, name):
+        entry = self.models.pop(name)
+        self.by_state[entry.state].discard(name)
+
+    def _set_state(self, entry, state, thread=None):
+        if state == IDLE and entry.jobs:
+            state = POSTPROCESSING
+        self.by_state[entry.state].discard(entry.name)
+        self.by_state[state].add(entry.name)
+        entry.state = state
+        entry.since = time.time()
+        if state in (IDLE, PROBING) or thread is not None:
+            entry.thread = thread
+        if state == IDLE and not entry.wanted:
+            self._remove(entry.name)
+
+    def transition(self, name, state, thread=None, expected=None, current=None):
+        with self.lock:
+            entry = self.models.get(name)
+            if entry is None or state not in TRANSITIONS[entry.state]:
+                return False
+            if current is not None and entry.state not in current:
+                return False
+            if expected is not None and entry.thread is not expected:
+                return False
+            if state in (PROBING, RECORDING) and not entry.wanted:
+                return False
+            self._set_state(entry, state, thread)
+            return True
+
+    def attach(self, name, thread):
+        with self.lock:
+            entry = self.models.get(name)
+            if entry is None or entry.state != PROBING:
+                return False
+            entry.thread = thread
+            return True
+
+    def claim(self, names, states=(IDLE, POSTPROCESSING)):
+        claimed = []
+        with self.lock:
+            for name in names:
+                entry = self.models.get(name)
+                if entry is not None and entry.wanted and entry.state in states:
+                    self._set_state(entry, PROBING)
+                    claimed.append(name)
+        return claimed
+
+    def add_job(self, name):
+        with self.lock:
+            entry = self.models.get(name)
+            if entry is None:
+                return
+            entry.jobs += 1
+            if entry.state == IDLE:
+                self._set_state(entry, POSTPROCESSING)
+
+    def finish_postprocessing(self, name):
+        with self.lock:
+            entry = self.models.get(name)
+            if entry is None or not entry.jobs:
+                return
+            entry.jobs -= 1
+            if not entry.jobs and entry.state == POSTPROCESSING:
+                self._set_state(entry, IDLE)
+
+    def release(self, names):
+        with self.lock:
+            for name in names:
+                entry = self.models.get(name)
+                if entry is not None and entry.state == PROBING and entry.thread is None:
+                    self._set_state(entry, IDLE)
+
+    def stop(self, name):
+        with self.lock:
+            entry = self.models.get(name)
+            thread = entry.thread if entry else None
+        if thread:
+            thread.stop()
+
+    def threads(self, state):
+        with self.lock:
+            return [self.models[name].thread for name in sorted(self.by_state[state]) if self.models[name].thread]
+
+    def count(self, state):
+        return len(self.by_state[state])
+
+    def counts(self):
+        return {state: len(names) for state, names in self.by_state.items()}
+
+    def priority(self, name):
+        entry = self.models.get(name)
+        return entry.priority if entry else 0
+
+    def state(self, name):
+        entry = self.models.get(name)
+        return entry.state if entry else None
@@ -0,0 +1,260 @@
+import asyncio
+import threading
+import time
+import aiohttp
+import lxml.etree
+import lxml.html
+from logWriter import log
+from metricsServer import Histogram
+
+BASE_URL = 'https://chaturbate.com'
+API_URL = '{base}/api/chatvideocontext/{model}/'
+LISTING_URL = '{base}/{gender}-cams/?page={page}'
+ROOM_TITLES = lxml.etree.XPath('//ul[contains(concat(" ", @class, " "), " list ")]//div[contains(concat(" ", @class, " "), " title ")]/a/@href')
+PAGE_LINKS = lxml.etree.XPath('//a[contains(concat(" ", @class, " "), " endless_page_link ")]/text()')
+
+
+def parse_listing(doc):
+    return {href.strip('/').lower() for href in ROOM_TITLES(doc)}
+
+
+def last_page(doc):
+    links = PAGE_LINKS(doc)
+    try:
+        return int(links[-2])
+    except (IndexError, ValueError):
+        return 1
+
+
+class OnlineProber:
+    def __init__(self, proxy_manager=None, concurrency=100, timeout=10, proxy_timeout=15, proxy_attempts=3, base_url=BASE_URL, route_cache=None):
+        self.proxy_manager = proxy_manager
+        self.route_cache = route_cache
+        self.base_url = base_url.rstrip('/')
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.proxy_timeout = proxy_timeout
+        self.proxy_attempts = proxy_attempts
+        self.session = None
+        self.checked = set()
+        self.denied = set()
+        self.genders = {}
+        self.listing = set()
+        self.listing_time = 0
+        self.stats = {
+            'cycles': 0,
+            'last_cycle_seconds': 0.0,
+            'avg_cycle_seconds': 0.0,
+            'last_probed': 0,
+            'last_online': 0,
+            'last_requests': 0,
+            'last_listing_seconds': 0.0,
+            'last_listing_pages': 0,
+            'last_listing_rooms': 0,
+        }
+        self.requests = 0
+        self.latency = Histogram()
+
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def probe(self, models):
+        models = list(models)
+        if not models:
+            return {}
+        future = asyncio.run_coroutine_threadsafe(self._probe_all(models), self.loop)
+        return future.result()
+
+    def bulk_candidates(self, models, genders, max_age=0):
+        models = list(models)
+        if not models:
+            return models
+        if time.time() - self.listing_time >= max_age:
+            future = asyncio.run_coroutine_threadsafe(self._crawl_listing(genders), self.loop)
+            self.listing = future.result()
+            self.listing_time = time.time()
+        online = self.listing
+        if not online:
+            self.log('Room listing returned no models, probing the whole wishlist', 'warning')
+            return models
+        return [m for m in models if m in online or m in self.denied or m not in self.checked]
+
+    def status(self):
+        status = dict(self.stats)
+        status['latency'] = self.latency.snapshot()
+        return status
+
+    def log(self, message, level='info'):
+        log('model_check', message, level)
+
+    async def _get_session(self):
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.concurrency, ttl_dns_cache=300, keepalive_timeout=60)
+            self.session = aiohttp.ClientSession(connector=connector)
+        return self.session
+
+    async def _probe_all(self, models):
+        start = time.time()
+        self.requests = 0
+        session = await self._get_session()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        results = await asyncio.gather(*(self._probe(session, semaphore, model) for model in models))
+        online = {model: hls_url for model, hls_url in zip(models, results) if hls_url}
+
+        elapsed = time.time() - start
+        self.stats['cycles'] += 1
+        self.stats['last_cycle_seconds'] = elapsed
+        self.stats['avg_cycle_seconds'] += (elapsed - self.stats['avg_cycle_seconds']) / self.stats['cycles']
+        self.stats['last_probed'] = len(models)
+        self.stats['last_online'] = len(online)
+        self.stats['last_requests'] = self.requests
+        self.log(f'Probe cycle: {len(models)} models, {len(online)} online, {self.requests} requests in {elapsed:.2f}s', 'debug')
+        return online
+
+    async def _fetch_listing_page(self, session, gender, page):
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        for attempt in range(3):
+            try:
+                async with session.get(LISTING_URL.format(base=self.base_url, gender=gender, page=page), timeout=timeout) as resp:
+                    return lxml.html.fromstring(await resp.read())
+            except Exception as e:
+                self.log(f'Listing {gender} page {page} attempt {attempt+1} failed: {e}', 'warning')
+        return None
+
+    async def _crawl_gender(self, session, semaphore, gender):
+        async with semaphore:
+            first = await self._fetch_listing_page(session, gender, 1)
+        if first is None:
+            return set(), 0
+        rooms = parse_listing(first)
+        pages = last_page(first)
+
+        async def fetch(page):
+            async with semaphore:
+                return await self._fetch_listing_page(session, gender, page)
+
+        docs = await asyncio.gather(*(fetch(page) for page in range(2, pages + 1)))
+        for doc in docs:
+            if doc is not None:
+                rooms |= parse_listing(doc)
+        return rooms, pages
+
+    async def _crawl_listing(self, genders):
+        start = time.time()
+        session = await self._get_session()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        results = await asyncio.gather(*(self._crawl_gender(session, semaphore, gender.lower()) for gender in genders))
+        online = set()
+        pages = 0
+        for rooms, gender_pages in results:
+            online |= rooms
+            pages += gender_pages
+
+        elapsed = time.time() - start
+        self.stats['last_listing_seconds'] = elapsed
+        self.stats['last_listing_pages'] = pages
+        self.stats['last_listing_rooms'] = len(online)
+        self.log(f'Room listing: {len(online)} online rooms from {pages} pages in {elapsed:.2f}s')
+        return online
+
+    async def _fetch_context(self, session, model, proxy=None):
+        self.requests += 1
+        timeout = aiohttp.ClientTimeout(total=self.proxy_timeout if proxy else self.timeout)
+        start = time.time()
+        async with session.get(API_URL.format(base=self.base_url, model=model), proxy=proxy, timeout=timeout) as resp:
+            json_data = await resp.json(content_type=None)
+        self.latency.observe(time.time() - start)
+        if json_data.get('broadcaster_gender'):
+            self.genders[model] = json_data['broadcaster_gender']
+        return json_data
+
+    async def _probe(self, session, semaphore, model):
+        async with semaphore:
+            cache = self.route_cache
+            if cache and cache.negative(model):
+                self.log(f'[{model}] Offline or unreachable a moment ago, not checking again yet', 'debug')
+                return False
+            self.log(f'[{model}] Checking if online...', 'debug')
+            tried = set()
+            hit, proxy = cache.lookup(model) if cache else (False, None)
+            if hit and proxy and self.proxy_manager:
+                self.log(f'[{model}] Trying the proxy that worked last: {proxy.get("http")}', 'debug')
+                tried.add(proxy.get('http'))
+                result = await self._probe_proxy(session, model, proxy)
+                if result is not None:
+                    return result
+
+            if cache and cache.is_denied(model):
+                self.log(f'[{model}] Direct connection is geo-blocked, going straight to proxies', 'debug')
+            else:
+                try:
+                    json_data = await self._fetch_context(session, model)
+                    self.log(f'[{model}] Direct connection response: {json_data}', 'debug')
+                    self.checked.add(model)
+                    if json_data.get('code') == 'access-denied':
+                        self.denied.add(model)
+                        if cache:
+                            cache.deny(model)
+                    elif 'hls_source' in json_data:
+                        self.denied.discard(model)
+                    if json_data.get('hls_source'):
+                        self.log(f'[{model}] ✓ Found stream via direct connection')
+                        if cache:
+                            cache.remember(model)
+                        return json_data['hls_source']
+                    if 'hls_source' in json_data:
+                        self.log(f'[{model}] ✗ Model offline', 'debug')
+                        if cache:
+                            cache.offline(model)
+                        return False
+                    self.log(f'[{model}] No stream in direct connection, trying proxy...', 'debug')
+                except Exception as e:
+                    self.log(f'[{model}] Direct connection failed: {e}', 'warning')
+
+            if self.proxy_manager is None:
+                return False
+
+            for attempt in range(self.proxy_attempts):
+                proxy = self.proxy_manager.get_random_proxy(*cache.regions(model)) if cache else self.proxy_manager.get_random_proxy()
+                if not proxy:
+                    self.log(f'[{model}] No proxy available', 'warning')
+                    break
+                if proxy.get('http') in tried or (cache and cache.is_denied(model, proxy)):
+                    continue
+                tried.add(proxy.get('http'))
+                self.log(f'[{model}] Attempt {attempt+1} with proxy: {proxy.get("http")}', 'debug')
+                result = await self._probe_proxy(session, model, proxy)
+                if result is not None:
+                    return result
+
+            self.log(f'[{model}] ✗ Model offline or geo-blocked (no working proxy)', 'debug')
+            if cache:
+                cache.unreachable(model)
+            return False
+
+    async def _probe_proxy(self, session, model, proxy):
+        cache = self.route_cache
+        try:
+            start = time.time()
+            json_data = await self._fetch_context(session, model, proxy=proxy.get('http'))
+            self.proxy_manager.record_result(proxy, True, time.time() - start)
+        except Exception as e:
+            self.log(f'[{model}] Proxy {proxy.get("http")} failed: {e}', 'warning')
+            self.proxy_manager.mark_proxy_failed(proxy)
+            if cache:
+                cache.forget(model, proxy)
+            return None
+        self.log(f'[{model}] Proxy response: {json_data}', 'debug')
+        if json_data.get('hls_source'):
+            self.log(f'[{model}] ✓ Found stream via PROXY!')
+            if cache:
+                cache.remember(model, proxy)
+            return json_data['hls_source']
+        if 'hls_source' in json_data:
+            if cache:
+                cache.offline(model, proxy)
+            return False
+        if cache and json_data.get('code') == 'access-denied':
+            cache.deny(model, proxy)
+        return None
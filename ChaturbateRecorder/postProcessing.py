@@ -0,0 +1,158 @@
+import os
+import sqlite3
+import subprocess
+import threading
+import time
+from logWriter import log
+from metricsServer import Histogram
+
+JOB_BUCKETS = (1, 5, 15, 60, 300, 900, 3600, 14400)
+PRUNE_INTERVAL = 3600
+
+
+class JobScheduler:
+    def __init__(self, command, db_file='postprocessing.db', max_workers=1, timeout=3600, retries=3, backoff=30, priority='age', on_finished=None, keep_finished=7 * 86400):
+        self.command = command
+        self.on_finished = on_finished
+        self.max_workers = max(max_workers, 1)
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.priority = priority
+        self.keep_finished = keep_finished
+        self.pruned = 0
+        self.cond = threading.Condition()
+        self.active = 0
+        self.duration = Histogram(JOB_BUCKETS)
+        self.wait = Histogram(JOB_BUCKETS)
+        self.stats = {'completed': 0, 'failed': 0, 'retried': 0}
+
+        self.db = sqlite3.connect(db_file, check_same_thread=False, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            model TEXT NOT NULL,
+            path TEXT NOT NULL,
+            priority REAL NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            created REAL NOT NULL,
+            not_before REAL NOT NULL DEFAULT 0,
+            finished REAL,
+            error TEXT)''')
+        self.db.execute('CREATE INDEX IF NOT EXISTS jobs_pending ON jobs (status, priority, not_before)')
+        self.prune()
+        replayed = self.db.execute("UPDATE jobs SET status = 'pending' WHERE status = 'running'").rowcount
+        pending = self.db.execute("SELECT COUNT(*) FROM jobs WHERE status = 'pending'").fetchone()[0]
+        if pending:
+            log('recorder', f'Post-processing: {pending} unfinished jobs replayed from {db_file} ({replayed} were interrupted)')
+
+    def start(self):
+        for i in range(self.max_workers):
+            threading.Thread(target=self.worker, daemon=True).start()
+
+    def submit(self, model, path):
+        now = time.time()
+        if self.priority == 'size':
+            try:
+                priority = os.path.getsize(path)
+            except OSError:
+                priority = 0
+        else:
+            priority = now
+        with self.cond:
+            self.db.execute('INSERT INTO jobs (model, path, priority, created) VALUES (?, ?, ?, ?)', (model, path, priority, now))
+            self.cond.notify()
+
+    def allowed_workers(self):
+        limit = self.max_workers
+        try:
+            load = os.getloadavg()[0] / (os.cpu_count() or 1)
+            if load > 1:
+                limit = int(limit / load)
+        except (AttributeError, OSError):
+            pass
+        try:
+            with open('/proc/pressure/io') as f:
+                io_pressure = float(f.readline().split()[1].split('=')[1])
+            if io_pressure > 20:
+                limit = limit // 2
+        except (OSError, IndexError, ValueError):
+            pass
+        return max(limit, 1)
+
+    def dequeue(self):
+        with self.cond:
+            while True:
+                now = time.time()
+                if self.active < self.allowed_workers():
+                    row = self.db.execute("SELECT id, model, path, attempts, created FROM jobs WHERE status = 'pending' AND not_before <= ? ORDER BY priority LIMIT 1", (now,)).fetchone()
+                    if row:
+                        self.db.execute("UPDATE jobs SET status = 'running' WHERE id = ?", (row[0],))
+                        self.active += 1
+                        return row
+                    next_due = self.db.execute("SELECT MIN(not_before) FROM jobs WHERE status = 'pending'").fetchone()[0]
+                    timeout = max(next_due - now, 0.1) if next_due else None
+                else:
+                    timeout = 5
+                self.cond.wait(timeout)
+
+    def worker(self):
+        while True:
+            job_id, model, path, attempts, created = self.dequeue()
+            start = time.time()
+            self.wait.observe(start - created)
+            error = None
+            try:
+                filename = os.path.split(path)[-1]
+                directory = os.path.dirname(path)
+                file = os.path.splitext(filename)[0]
+                result = subprocess.run(self.command.split() + [path, filename, directory, model, file, 'cam4'], timeout=self.timeout)
+                if result.returncode:
+                    error = f'exit code {result.returncode}'
+            except subprocess.TimeoutExpired:
+                error = f'timed out after {self.timeout}s'
+            except Exception as e:
+                error = str(e)
+            self.duration.observe(time.time() - start)
+            self.finish(job_id, model, attempts + 1, error)
+
+    def finish(self, job_id, model, attempts, error):
+        now = time.time()
+        with self.cond:
+            self.active -= 1
+            if error is None:
+                self.db.execute("UPDATE jobs SET status = 'done', attempts = ?, finished = ? WHERE id = ?", (attempts, now, job_id))
+                self.stats['completed'] += 1
+            elif attempts <= self.retries:
+                delay = self.backoff * 2 ** (attempts - 1)
+                self.db.execute("UPDATE jobs SET status = 'pending', attempts = ?, not_before = ?, error = ? WHERE id = ?", (attempts, now + delay, error, job_id))
+                self.stats['retried'] += 1
+                log('recorder', f'Post-processing of {model} failed ({error}), retrying in {delay}s', 'warning')
+            else:
+                self.db.execute("UPDATE jobs SET status = 'failed', attempts = ?, finished = ?, error = ? WHERE id = ?", (attempts, now, error, job_id))
+                self.stats['failed'] += 1
+                log('recorder', f'Post-processing of {model} failed after {attempts} attempts: {error}', 'error')
+            self.cond.notify_all()
+            if now - self.pruned >= PRUNE_INTERVAL:
+                self.prune()
+        if self.on_finished and (error is None or attempts > self.retries):
+            self.on_finished(model)
+
+    def prune(self):
+        self.pruned = time.time()
+        if self.keep_finished <= 0:
+            return
+        removed = self.db.execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished < ?", (self.pruned - self.keep_finished,)).rowcount
+        if removed:
+            log('recorder', f'Post-processing: removed {removed} finished jobs older than {self.keep_finished / 86400:g} days', 'debug')
+
+    def status(self):
+        with self.cond:
+            pending = self.db.execute("SELECT COUNT(*) FROM jobs WHERE status = 'pending'").fetchone()[0]
+        status = dict(self.stats)
+        status['queue_depth'] = pending
+        status['running'] = self.active
+        status['duration'] = self.duration.snapshot()
+        status['wait'] = self.wait.snapshot()
+        return status
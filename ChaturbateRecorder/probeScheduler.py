@@ -0,0 +1,157 @@
+import heapq
+import json
+import os
+import random
+import threading
+import time
+from logWriter import log
+
+RECENT_SECONDS = 3600
+LIKELY_SHARE = 0.25
+
+
+class ModelHistory:
+    __slots__ = ('last_online', 'streak', 'hourly')
+
+    def __init__(self, last_online=0.0, streak=0, hourly=None):
+        self.last_online = last_online
+        self.streak = streak
+        self.hourly = hourly or [0.0] * 24
+
+
+class ProbeScheduler:
+    def __init__(self, min_interval=20, max_interval=600, rate=10, jitter=0.2, history_file=None):
+        self.min_interval = max(min_interval, 1)
+        self.max_interval = max(max_interval, self.min_interval)
+        self.rate = rate
+        self.jitter = jitter
+        self.history_file = history_file
+        self.lock = threading.RLock()
+        self.history = {}
+        self.due_at = {}
+        self.heap = []
+        self.tokens = float(rate)
+        self.refilled = time.time()
+        self.stats = {'scheduled': 0, 'backlog': 0, 'probes': 0, 'deferred': 0}
+
+    def add(self, model):
+        with self.lock:
+            if model in self.due_at:
+                return
+            self.history.setdefault(model, ModelHistory())
+            self.push(model, time.time() + random.uniform(0, self.min_interval))
+
+    def discard(self, model):
+        with self.lock:
+            self.due_at.pop(model, None)
+            self.stats['scheduled'] = len(self.due_at)
+
+    def push(self, model, due):
+        with self.lock:
+            self.due_at[model] = due
+            heapq.heappush(self.heap, (due, model))
+            self.stats['scheduled'] = len(self.due_at)
+
+    def refill(self, now):
+        if not self.rate:
+            return
+        self.tokens = min(self.tokens + (now - self.refilled) * self.rate, self.rate)
+        self.refilled = now
+
+    def due(self):
+        with self.lock:
+            now = time.time()
+            self.refill(now)
+            models = []
+            backlog = 0
+            while self.heap and self.heap[0][0] <= now:
+                if self.rate and self.tokens < 1:
+                    backlog = sum(1 for due, model in self.heap if due <= now and self.due_at.get(model) == due)
+                    break
+                due, model = heapq.heappop(self.heap)
+                if self.due_at.get(model) != due:
+                    continue
+                del self.due_at[model]
+                models.append(model)
+                if self.rate:
+                    self.tokens -= 1
+            self.stats['backlog'] = backlog
+            self.stats['probes'] += len(models)
+            return models
+
+    def interval(self, history, now):
+        if now - history.last_online < RECENT_SECONDS:
+            return self.min_interval
+        interval = min(self.min_interval * 1.5 ** history.streak, self.max_interval)
+        hour = time.localtime(now).tm_hour
+        if max(history.hourly[hour], history.hourly[(hour + 1) % 24]) >= LIKELY_SHARE:
+            interval = min(interval, self.min_interval * 3)
+        return interval
+
+    def record(self, model, online):
+        with self.lock:
+            history = self.history.get(model)
+            if history is None:
+                return
+            now = time.time()
+            hour = time.localtime(now).tm_hour
+            history.hourly[hour] += 0.2 * ((1.0 if online else 0.0) - history.hourly[hour])
+            if online:
+                history.last_online = now
+                history.streak = 0
+            else:
+                history.streak = min(history.streak + 1, 32)
+            self.reschedule(model, self.interval(history, now))
+
+    def defer(self, model):
+        with self.lock:
+            history = self.history.get(model)
+            if history is None:
+                return
+            history.last_online = time.time()
+            self.stats['deferred'] += 1
+            self.reschedule(model, self.min_interval)
+
+    def reschedule(self, model, interval):
+        interval *= 1 + random.uniform(-self.jitter, self.jitter)
+        self.push(model, time.time() + interval)
+
+    def status(self):
+        return dict(self.stats)
+
+    def save(self):
+        if not self.history_file:
+            return
+        with self.lock:
+            data = {model: [round(h.last_online), h.streak, [round(share, 3) for share in h.hourly]]
+                    for model, h in self.history.items() if model in self.due_at}
+        tmp = self.history_file + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(data, f, separators=(',', ':'))
+        os.replace(tmp, self.history_file)
+
+    def load(self):
+        if not self.history_file or not os.path.exists(self.history_file):
+            return
+        try:
+            with open(self.history_file) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if not isinstance(data, dict):
+            log('model_check', f'Ignoring probe history {self.history_file}: not a JSON object', 'error')
+            return
+        skipped = 0
+        for model, entry in data.items():
+            try:
+                last_online, streak, hourly = entry
+                hourly = [float(share) for share in hourly]
+                if len(hourly) != 24:
+                    raise ValueError
+                history = ModelHistory(float(last_online), int(streak), hourly)
+            except (TypeError, ValueError):
+                skipped += 1
+                continue
+            self.history[model] = history
+        if skipped:
+            log('model_check', f'Skipped {skipped} malformed entries in probe history {self.history_file}', 'warning')
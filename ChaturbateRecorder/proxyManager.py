@@ -1,196 +1,501 @@
 import requests
 import random
+import json
+import os
 import time
-import datetime
-from threading import Lock
+from threading import Lock, Thread
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
 from bs4 import BeautifulSoup
+from logWriter import log
+
+API_SOURCES = [
+    'https://api.proxyscrape.com/v2/?request=displayproxies&protocol=http&timeout=10000&country=all&ssl=all&anonymity=all',
+    'https://api.proxyscrape.com/v2/?request=displayproxies&protocol=https&timeout=10000&country=all&ssl=all&anonymity=all',
+    'https://www.proxy-list.download/api/v1/get?type=http',
+    'https://www.proxy-list.download/api/v1/get?type=https',
+    'https://raw.githubusercontent.com/TheSpeedX/PROXY-List/master/http.txt',
+    'https://raw.githubusercontent.com/ShiftyTR/Proxy-List/master/http.txt',
+    'https://raw.githubusercontent.com/ShiftyTR/Proxy-List/master/https.txt',
+    'https://raw.githubusercontent.com/monosans/proxy-list/main/proxies/http.txt',
+    'https://raw.githubusercontent.com/monosans/proxy-list/main/proxies_anonymous/http.txt',
+    'https://raw.githubusercontent.com/clarketm/proxy-list/master/proxy-list-raw.txt',
+    'https://raw.githubusercontent.com/sunny9577/proxy-scraper/master/proxies.txt',
+    'https://raw.githubusercontent.com/hendrikbgr/Free-Proxy-Repo/master/proxy_list.txt',
+]
+
+HTML_SOURCES = [
+    'https://www.sslproxies.org/',
+    'https://free-proxy-list.net/',
+    'https://www.us-proxy.org/'
+]
+
+VALIDATE_URL = 'https://chaturbate.com/api/chatvideocontext/test/'
 
 class ProxyManager:
     def __init__(self):
         self.proxies = []
         self.working_proxies = []
-        self.failed_proxies = set()
+        self.failed_proxies = OrderedDict()
+        self.failed_ttl = 3600
+        self.failed_max = 5000
+        self.health = {}
+        self.verified = {}
+        self.regions = {}
+        self.validate_url = VALIDATE_URL
+        self.fetch_lists = True
+        self.cache_file = 'proxy_cache.json'
+        self.cache_max_age = 86400
+        self.revalidate_after = 600
+        self.ewma_alpha = 0.3
+        self.breaker_threshold = 2
+        self.breaker_cooldown = 60
+        self.breaker_max_opens = 2
+        self.snapshot = ()
+        self.trials = {}
+        self.trial_timeout = 30
+        self.low_watermark = 3
+        self.refill_backoff = 30
+        self.last_refill_request = 0
         self.lock = Lock()
         self.last_update = 0
         self.update_interval = 300
-        self.log_file = 'proxy_debug.log'
+        self.refresh_lock = Lock()
+        self.session = requests.Session()
+        self.source_cache = {}
+        self.fetch_workers = 16
+        self.test_workers = 20
+        self.target_working = 10
+        self.max_tests = 50
+        self.stats = {
+            'refreshes': 0,
+            'last_refresh_seconds': 0.0,
+            'last_fetch_seconds': 0.0,
+            'last_test_seconds': 0.0,
+            'sources_not_modified': 0,
+            'requests': 0,
+            'hits': 0,
+            'region_hits': 0,
+            'region_misses': 0,
+        }
 
-    def fetch_free_proxies(self):
+    def fetch_source(self, source, parser):
+        headers = {}
+        cached = self.source_cache.get(source)
+        if cached:
+            if cached['etag']:
+                headers['If-None-Match'] = cached['etag']
+            if cached['last_modified']:
+                headers['If-Modified-Since'] = cached['last_modified']
+
+        response = self.session.get(source, headers=headers, timeout=8)
+        if response.status_code == 304 and cached:
+            self.stats['sources_not_modified'] += 1
+            self.log(f'  -> Not modified, reusing {len(cached["proxies"])} proxies from {source}')
+            return cached['proxies']
+
+        proxies = parser(response)
+        self.source_cache[source] = {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'proxies': proxies,
+        }
+        self.log(f'  -> Got {len(proxies)} proxies from {source}')
+        return proxies
+
+    def parse_proxy_list(self, response):
         proxy_list = []
+        for line in response.text.split('\n'):
+            line = line.strip()
+            if line and ':' in line and not line.startswith('#'):
+                if 'http://' not in line and 'https://' not in line:
+                    proxy_list.append(f'http://{line}')
+                else:
+                    proxy_list.append(line)
+        return proxy_list
 
-        api_sources = [
-            'https://api.proxyscrape.com/v2/?request=displayproxies&protocol=http&timeout=10000&country=all&ssl=all&anonymity=all',
-            'https://api.proxyscrape.com/v2/?request=displayproxies&protocol=https&timeout=10000&country=all&ssl=all&anonymity=all',
-            'https://www.proxy-list.download/api/v1/get?type=http',
-            'https://www.proxy-list.download/api/v1/get?type=https',
-            'https://raw.githubusercontent.com/TheSpeedX/PROXY-List/master/http.txt',
-            'https://raw.githubusercontent.com/ShiftyTR/Proxy-List/master/http.txt',
-            'https://raw.githubusercontent.com/ShiftyTR/Proxy-List/master/https.txt',
-            'https://raw.githubusercontent.com/monosans/proxy-list/main/proxies/http.txt',
-            'https://raw.githubusercontent.com/monosans/proxy-list/main/proxies_anonymous/http.txt',
-            'https://raw.githubusercontent.com/clarketm/proxy-list/master/proxy-list-raw.txt',
-            'https://raw.githubusercontent.com/sunny9577/proxy-scraper/master/proxies.txt',
-            'https://raw.githubusercontent.com/hendrikbgr/Free-Proxy-Repo/master/proxy_list.txt',
-        ]
-
-        for source in api_sources:
-            try:
-                self.log(f'Fetching from: {source}')
-                response = requests.get(source, timeout=8)
-                count_before = len(proxy_list)
-                for line in response.text.split('\n'):
-                    line = line.strip()
-                    if line and ':' in line and not line.startswith('#'):
-                        if 'http://' not in line and 'https://' not in line:
-                            proxy_list.append(f'http://{line}')
-                        else:
-                            proxy_list.append(line)
-                count_after = len(proxy_list)
-                self.log(f'  -> Got {count_after - count_before} proxies from this source')
-            except Exception as e:
-                self.log(f'  -> Failed to fetch from {source}: {e}')
-                continue
+    def parse_proxy_table(self, response):
+        proxy_list = []
+        soup = BeautifulSoup(response.content, 'html.parser')
+        table = soup.find('table', {'class': 'table table-striped table-bordered'})
+        if table:
+            for row in table.find('tbody').find_all('tr'):
+                cols = row.find_all('td')
+                if len(cols) >= 7:
+                    ip = cols[0].text.strip()
+                    port = cols[1].text.strip()
+                    code = cols[2].text.strip().upper()
+                    https = cols[6].text.strip()
 
-        try:
-            sources = [
-                'https://www.sslproxies.org/',
-                'https://free-proxy-list.net/',
-                'https://www.us-proxy.org/'
-            ]
+                    if https == 'yes':
+                        proxy = f'https://{ip}:{port}'
+                    else:
+                        proxy = f'http://{ip}:{port}'
+                    proxy_list.append(proxy)
+                    if len(code) == 2 and code.isalpha():
+                        self.regions[proxy] = code
+        return proxy_list
 
-            for source in sources:
+    def fetch_free_proxies(self):
+        proxy_list = []
+        jobs = [(source, self.parse_proxy_list) for source in API_SOURCES]
+        jobs += [(source, self.parse_proxy_table) for source in HTML_SOURCES]
+
+        self.log(f'Fetching {len(jobs)} sources concurrently...')
+        with ThreadPoolExecutor(max_workers=self.fetch_workers) as executor:
+            futures = {executor.submit(self.fetch_source, source, parser): source for source, parser in jobs}
+            for future in as_completed(futures):
                 try:
-                    self.log(f'Scraping HTML from: {source}')
-                    response = requests.get(source, timeout=8)
-                    soup = BeautifulSoup(response.content, 'html.parser')
-                    table = soup.find('table', {'class': 'table table-striped table-bordered'})
-
-                    count_before = len(proxy_list)
-                    if table:
-                        for row in table.find('tbody').find_all('tr'):
-                            cols = row.find_all('td')
-                            if len(cols) >= 7:
-                                ip = cols[0].text.strip()
-                                port = cols[1].text.strip()
-                                https = cols[6].text.strip()
-
-                                if https == 'yes':
-                                    proxy_list.append(f'https://{ip}:{port}')
-                                else:
-                                    proxy_list.append(f'http://{ip}:{port}')
-                    count_after = len(proxy_list)
-                    self.log(f'  -> Got {count_after - count_before} proxies from HTML scraping')
+                    proxy_list.extend(future.result())
                 except Exception as e:
-                    self.log(f'  -> Failed to scrape {source}: {e}')
-                    continue
-        except Exception as e:
-            self.log(f'Error in HTML scraping section: {e}')
+                    self.log(f'  -> Failed to fetch from {futures[future]}: {e}', 'warning')
 
         unique_proxies = list(set(proxy_list))
         self.log(f'Total unique proxies after deduplication: {len(unique_proxies)}')
         return unique_proxies
 
-    def test_proxy(self, proxy, test_url='http://www.google.com'):
+    def test_candidates(self, candidates, needed):
+        found = []
+        pending = iter(candidates)
+        in_flight = {}
+        executor = ThreadPoolExecutor(max_workers=self.test_workers)
+        try:
+            for proxy in pending:
+                in_flight[executor.submit(self.timed_test, proxy)] = proxy
+                if len(in_flight) >= self.test_workers:
+                    break
+
+            while in_flight and len(found) < needed:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    proxy = in_flight.pop(future)
+                    ok, latency = future.result()
+                    if ok:
+                        found.append(proxy)
+                        self.record_result(proxy, True, latency)
+                        self.log(f'✓ WORKING proxy #{len(found)} ({latency:.2f}s): {proxy} [{self.regions.get(proxy) or "unknown region"}]')
+                    else:
+                        self.log(f'✗ Failed: {proxy}', 'debug')
+                if len(found) >= needed:
+                    break
+                for proxy in pending:
+                    in_flight[executor.submit(self.timed_test, proxy)] = proxy
+                    if len(in_flight) >= self.test_workers:
+                        break
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+        return found[:needed]
+
+    def timed_test(self, proxy):
+        start = time.time()
+        ok = self.test_proxy(proxy)
+        return ok, time.time() - start
+
+    def test_proxy(self, proxy, test_url=None):
         try:
             proxies = {
                 'http': proxy,
                 'https': proxy
             }
-            response = requests.get(test_url, proxies=proxies, timeout=5)
-            if response.status_code == 200:
-                return True
+            response = requests.get(test_url or self.validate_url, proxies=proxies, timeout=5)
+            return isinstance(response.json(), dict)
         except:
             pass
         return False
 
-    def log(self, message):
-        timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        log_message = f'[{timestamp}] {message}\n'
-        try:
-            with open(self.log_file, 'a') as f:
-                f.write(log_message)
-        except:
-            pass
-        print(log_message.strip())
+    def region(self, proxy_dict):
+        if isinstance(proxy_dict, dict):
+            proxy_dict = proxy_dict.get('http') or proxy_dict.get('https')
+        return self.regions.get(proxy_dict, '')
+
+    def by_region(self, snapshot, prefer, avoid):
+        if prefer:
+            preferred = tuple(entry for entry in snapshot if self.regions.get(entry[0]) in prefer)
+            if preferred:
+                self.stats['region_hits'] += 1
+                return preferred
+        allowed = tuple(entry for entry in snapshot if self.regions.get(entry[0], '') not in avoid)
+        if not allowed:
+            self.stats['region_misses'] += 1
+        return allowed
+
+    def region_counts(self):
+        counts = {}
+        for proxy, weight, retry_at in self.snapshot:
+            if not retry_at:
+                region = self.regions.get(proxy) or 'unknown'
+                counts[region] = counts.get(region, 0) + 1
+        return counts
+
+    def log(self, message, level='info'):
+        log('proxy', message, level)
 
     def update_proxies(self, force=False):
+        if not self.fetch_lists:
+            return
         current_time = time.time()
 
         if not force and (current_time - self.last_update) < self.update_interval:
             return
 
-        self.lock.acquire()
+        if not self.refresh_lock.acquire(blocking=False):
+            return
+        refresh_start = time.time()
         try:
             self.log('='*60)
             self.log('Starting proxy fetch cycle')
             self.log('Fetching free proxies from multiple sources...')
             new_proxies = self.fetch_free_proxies()
             self.log(f'Found {len(new_proxies)} total proxies from all sources')
+            self.stats['last_fetch_seconds'] = time.time() - refresh_start
 
             self.proxies = new_proxies
             self.last_update = current_time
+            self.lock.acquire()
+            try:
+                keep = set(new_proxies).union(self.working_proxies)
+                self.regions = {proxy: region for proxy, region in self.regions.items() if proxy in keep}
+            finally:
+                self.lock.release()
 
             if len(new_proxies) == 0:
-                self.log('WARNING: No proxies found from any source!')
+                self.log('WARNING: No proxies found from any source!', 'warning')
                 return
 
-            self.log(f'Testing proxies (up to 50 tests, stopping at 10 working)...')
-            tested = 0
-            working_found = 0
-            for proxy in self.proxies[:100]:
-                if len(self.working_proxies) >= 10:
-                    self.log('Reached 10 working proxies, stopping tests')
-                    break
-                if tested >= 50:
-                    self.log('Reached 50 test attempts, stopping')
-                    break
-                if proxy not in self.failed_proxies:
-                    self.log(f'Testing proxy {tested+1}: {proxy}')
-                    if self.test_proxy(proxy):
-                        if proxy not in self.working_proxies:
-                            self.working_proxies.append(proxy)
-                            working_found += 1
-                            self.log(f'✓ WORKING proxy #{working_found}: {proxy}')
-                    else:
-                        self.log(f'✗ Failed: {proxy}')
-                tested += 1
+            needed = self.target_working - self.get_proxy_count()
+            if needed <= 0:
+                self.log(f'Already have {self.get_proxy_count()} working proxies, skipping tests')
+                return
+
+            self.lock.acquire()
+            try:
+                self.expire_failed()
+                candidates = [p for p in self.proxies if p not in self.failed_proxies and p not in self.working_proxies]
+                candidates.sort(key=lambda p: p not in self.regions)
+                candidates = candidates[:self.max_tests]
+            finally:
+                self.lock.release()
+            self.log(f'Testing {len(candidates)} proxies with {self.test_workers} workers, stopping at {needed} working...')
+            test_start = time.time()
+            found = self.test_candidates(candidates, needed)
+            self.stats['last_test_seconds'] = time.time() - test_start
+
+            self.lock.acquire()
+            try:
+                for proxy in found:
+                    if proxy not in self.working_proxies:
+                        self.working_proxies.append(proxy)
+                self.publish()
+            finally:
+                self.lock.release()
 
             self.log(f'Testing complete. Total working proxies: {len(self.working_proxies)}')
             self.log('='*60)
         except Exception as e:
-            self.log(f'ERROR in update_proxies: {e}')
+            self.log(f'ERROR in update_proxies: {e}', 'error')
         finally:
-            self.lock.release()
+            self.stats['refreshes'] += 1
+            self.stats['last_refresh_seconds'] = time.time() - refresh_start
+            self.refresh_lock.release()
+
+    def get_random_proxy(self, prefer=(), avoid=()):
+        self.stats['requests'] += 1
+        snapshot = self.snapshot
+        if not snapshot:
+            self.request_refill()
+            return None
+        if prefer or avoid:
+            snapshot = self.by_region(snapshot, prefer, avoid)
+
+        now = time.time()
+        closed = []
+        closed_weights = []
+        candidates = []
+        weights = []
+        for proxy, weight, retry_at in snapshot:
+            if not retry_at:
+                closed.append(proxy)
+                closed_weights.append(weight)
+            elif retry_at > now or now - self.trials.get(proxy, 0) < self.trial_timeout:
+                continue
+            candidates.append((proxy, retry_at))
+            weights.append(weight)
+        if len(closed) <= self.low_watermark:
+            self.request_refill()
+        if not candidates:
+            return None
+
+        proxy, retry_at = random.choices(candidates, weights=weights)[0]
+        if retry_at:
+            if now - self.trials.get(proxy, now) >= self.trial_timeout:
+                self.trials.pop(proxy, None)
+            if self.trials.setdefault(proxy, now) is not now:
+                if not closed:
+                    return None
+                proxy = random.choices(closed, weights=closed_weights)[0]
+        self.stats['hits'] += 1
+        return {
+            'http': proxy,
+            'https': proxy
+        }
+
+    def request_refill(self):
+        now = time.time()
+        if self.refresh_lock.locked() or now - self.last_refill_request < self.refill_backoff:
+            return
+        self.last_refill_request = now
+        Thread(target=self.update_proxies, kwargs={'force': True}, daemon=True).start()
+
+    def publish(self):
+        snapshot = []
+        for proxy in self.working_proxies:
+            health = self.health.get(proxy)
+            if health is None:
+                snapshot.append((proxy, 0.5, 0))
+                continue
+            weight = max(health['success'], 0.01) / max(health['latency'], 0.05)
+            retry_at = health['opened_at'] + self.breaker_cooldown if health['state'] == 'open' else 0
+            snapshot.append((proxy, weight, retry_at))
+        self.snapshot = tuple(snapshot)
+
+    def record_result(self, proxy_dict, ok, latency=None):
+        if not proxy_dict:
+            return
+        if isinstance(proxy_dict, dict):
+            proxy = proxy_dict.get('http') or proxy_dict.get('https')
+        else:
+            proxy = proxy_dict
+        if not proxy:
+            return
 
-    def get_random_proxy(self):
         self.lock.acquire()
         try:
-            if not self.working_proxies:
-                self.update_proxies(force=True)
-
-            if self.working_proxies:
-                proxy = random.choice(self.working_proxies)
-                return {
-                    'http': proxy,
-                    'https': proxy
-                }
-            return None
+            trial = self.trials.pop(proxy, None) is not None
+            health = self.health.get(proxy)
+            if health is None:
+                health = {'latency': latency or 1.0, 'success': 1.0 if ok else 0.0, 'failures': 0, 'opens': 0, 'state': 'closed', 'opened_at': 0}
+                self.health[proxy] = health
+            else:
+                health['success'] += self.ewma_alpha * ((1.0 if ok else 0.0) - health['success'])
+                if latency is not None:
+                    health['latency'] += self.ewma_alpha * (latency - health['latency'])
+
+            if ok:
+                self.verified[proxy] = time.time()
+                health['failures'] = 0
+                health['opens'] = 0
+                health['state'] = 'closed'
+            else:
+                health['failures'] += 1
+                if trial or health['failures'] >= self.breaker_threshold:
+                    health['state'] = 'open'
+                    health['opened_at'] = time.time()
+                    health['opens'] += 1
+                    if health['opens'] >= self.breaker_max_opens:
+                        self.drop_proxy(proxy)
+            self.publish()
         finally:
             self.lock.release()
 
+    def drop_proxy(self, proxy):
+        if proxy in self.working_proxies:
+            self.working_proxies.remove(proxy)
+        self.health.pop(proxy, None)
+        self.verified.pop(proxy, None)
+        self.failed_proxies[proxy] = time.time()
+        self.failed_proxies.move_to_end(proxy)
+        while len(self.failed_proxies) > self.failed_max:
+            self.failed_proxies.popitem(last=False)
+
+    def expire_failed(self):
+        cutoff = time.time() - self.failed_ttl
+        while self.failed_proxies:
+            proxy, failed_at = next(iter(self.failed_proxies.items()))
+            if failed_at > cutoff:
+                break
+            del self.failed_proxies[proxy]
+
     def mark_proxy_failed(self, proxy_dict):
-        if not proxy_dict:
-            return
+        self.record_result(proxy_dict, False)
 
+    def save_cache(self):
         self.lock.acquire()
         try:
-            proxy = proxy_dict.get('http') or proxy_dict.get('https')
-            if proxy:
-                self.failed_proxies.add(proxy)
-                if proxy in self.working_proxies:
-                    self.working_proxies.remove(proxy)
+            entries = {}
+            for proxy in self.working_proxies:
+                health = self.health.get(proxy, {})
+                entries[proxy] = [round(health.get('latency', 1.0), 3), round(health.get('success', 0.5), 3), int(self.verified.get(proxy, 0)), self.regions.get(proxy, '')]
+        finally:
+            self.lock.release()
+        try:
+            tmp = f'{self.cache_file}.{os.getpid()}.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(entries, f, separators=(',', ':'))
+            os.replace(tmp, self.cache_file)
+        except Exception as e:
+            self.log(f'Failed to save proxy cache: {e}', 'error')
+
+    def load_cache(self):
+        try:
+            with open(self.cache_file, 'r') as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return 0
+        except Exception as e:
+            self.log(f'Failed to load proxy cache: {e}', 'error')
+            return 0
+        if not isinstance(entries, dict):
+            self.log(f'Ignoring proxy cache {self.cache_file}: not a JSON object', 'error')
+            return 0
+
+        now = time.time()
+        skipped = 0
+        self.lock.acquire()
+        try:
+            for proxy, entry in entries.items():
+                try:
+                    latency, success, verified = (float(value) for value in entry[:3])
+                except (TypeError, ValueError):
+                    skipped += 1
+                    continue
+                if now - verified > self.cache_max_age or proxy in self.working_proxies:
+                    continue
+                if len(entry) > 3 and isinstance(entry[3], str) and entry[3]:
+                    self.regions[proxy] = entry[3]
+                self.working_proxies.append(proxy)
+                self.verified[proxy] = verified
+                self.health[proxy] = {'latency': latency, 'success': success, 'failures': 0, 'opens': 0, 'state': 'closed', 'opened_at': 0}
+            count = len(self.working_proxies)
+            self.publish()
         finally:
             self.lock.release()
+        if skipped:
+            self.log(f'Skipped {skipped} malformed entries in proxy cache {self.cache_file}', 'warning')
+        self.log(f'Loaded {count} proxies from cache {self.cache_file}')
+        return count
+
+    def revalidate_cache(self):
+        now = time.time()
+        stale = [p for p in list(self.working_proxies) if now - self.verified.get(p, 0) > self.revalidate_after]
+        if not stale:
+            return
+        self.log(f'Revalidating {len(stale)} cached proxies...')
+        with ThreadPoolExecutor(max_workers=self.test_workers) as executor:
+            results = list(executor.map(self.timed_test, stale))
+        dropped = 0
+        for proxy, (ok, latency) in zip(stale, results):
+            if ok:
+                self.record_result(proxy, True, latency)
+            else:
+                self.lock.acquire()
+                try:
+                    self.drop_proxy(proxy)
+                    self.publish()
+                finally:
+                    self.lock.release()
+                dropped += 1
+        self.log(f'Revalidation complete: {len(stale) - dropped} still working, {dropped} dropped')
+        self.save_cache()
 
     def get_proxy_count(self):
-        return len(self.working_proxies)
+        return sum(1 for proxy, weight, retry_at in self.snapshot if not retry_at)
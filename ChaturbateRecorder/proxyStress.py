@@ -0,0 +1,64 @@
+import argparse, random, sys, threading, time
+from proxyManager import ProxyManager
+
+
+def fakeFetch():
+    time.sleep(args.fetch_delay)
+    return [f'http://10.{random.randint(0, 255)}.{random.randint(0, 255)}.{i}:8080' for i in range(200)]
+
+
+def fakeTest(proxy, test_url=None):
+    time.sleep(random.uniform(0.2, 1.0))
+    return random.random() < 0.6
+
+
+def worker(deadline, results):
+    calls = 0
+    latencies = []
+    while time.time() < deadline:
+        start = time.perf_counter()
+        proxy = manager.get_random_proxy()
+        latencies.append(time.perf_counter() - start)
+        calls += 1
+        if proxy:
+            start = time.perf_counter()
+            if random.random() < args.failure_rate:
+                manager.mark_proxy_failed(proxy)
+            else:
+                manager.record_result(proxy, True, random.uniform(0.1, 2.0))
+            latencies.append(time.perf_counter() - start)
+        time.sleep(0.001)
+    results.append((calls, latencies))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Hammer ProxyManager with concurrent readers while refills run in the background.')
+    parser.add_argument('--threads', type=int, default=300)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--failure-rate', type=float, default=0.3)
+    parser.add_argument('--fetch-delay', type=float, default=3.0, help='simulated scrape time of one refill')
+    parser.add_argument('--stall', type=float, default=0.5, help='a single call slower than this counts as a stall')
+    args = parser.parse_args()
+
+    manager = ProxyManager()
+    manager.log = lambda message, level='info': None
+    manager.fetch_free_proxies = fakeFetch
+    manager.test_proxy = fakeTest
+    manager.refill_backoff = 1
+
+    results = []
+    deadline = time.time() + args.seconds
+    workers = [threading.Thread(target=worker, args=(deadline, results)) for i in range(args.threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+
+    calls = sum(r[0] for r in results)
+    latencies = sorted(l for r in results for l in r[1])
+    stalls = sum(1 for l in latencies if l > args.stall)
+    print(f'{args.threads} threads, {calls} get_random_proxy calls in {args.seconds:.0f}s ({calls / args.seconds:.0f}/s)')
+    print(f'call latency p50 {latencies[len(latencies) // 2] * 1000:.2f}ms, p99 {latencies[int(len(latencies) * 0.99)] * 1000:.2f}ms, max {latencies[-1] * 1000:.2f}ms')
+    print(f'{manager.stats["refreshes"]} background refills, {manager.get_proxy_count()} proxies in pool at the end')
+    print(f'{stalls} calls slower than {args.stall * 1000:.0f}ms')
+    sys.exit(1 if stalls else 0)
@@ -0,0 +1,268 @@
+import asyncio
+import threading
+import time
+import aiohttp
+from concurrent.futures import ThreadPoolExecutor
+from hlsPrefetcher import parse_master_playlist, parse_media_playlist
+
+
+class AsyncHLSStream:
+    def __init__(self, session, url, proxy=None, prefetch_depth=6, live_edge=3, timeout=10, stall_timeout=30, choose_variant=None):
+        self.session = session
+        self.choose_variant = choose_variant
+        self.url = url
+        self.proxy = proxy
+        self.prefetch_depth = max(prefetch_depth, 1)
+        self.live_edge = max(live_edge, 1)
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.stall_timeout = stall_timeout
+        self.media_url = None
+        self.variants = []
+        self.switched = False
+        self.roll_seq = None
+        self.rolled = False
+        self.known = {}
+        self.fetching = {}
+        self.next_seq = None
+        self.queued_seq = None
+        self.last_seq = None
+        self.newest = None
+        self.newest_at = 0
+        self.target_duration = 2.0
+        self.ended = False
+        self.closed = False
+        self.error = None
+        self.changed = asyncio.Event()
+        self.poller = None
+        self.last_progress = time.time()
+        self.stats = {
+            'segments': 0,
+            'dropped': 0,
+            'fetch_latency': 0.0,
+            'lag_seconds': 0.0,
+            'variant_bandwidth': 0,
+            'variant_switches': 0,
+        }
+
+    async def get(self, url):
+        async with self.session.get(url, proxy=self.proxy, timeout=self.timeout) as response:
+            response.raise_for_status()
+            return await response.read(), str(response.url)
+
+    async def open(self):
+        body, url = await self.get(self.url)
+        text = body.decode(errors='replace')
+        if '#EXT-X-STREAM-INF' in text:
+            self.variants = parse_master_playlist(text, url)
+            if not self.variants:
+                raise IOError('No variants found in master playlist')
+            index = self.choose_variant(self.variants) if self.choose_variant else -1
+            self.media_url = self.variants[index]['url']
+            self.stats['variant_bandwidth'] = self.variants[index]['bandwidth']
+            playlist = await self.fetch_playlist()
+        else:
+            self.media_url = url
+            playlist = parse_media_playlist(text, url)
+        self.schedule(playlist)
+        self.poller = asyncio.create_task(self.poll())
+        return self
+
+    async def fetch_playlist(self):
+        media_url = self.media_url
+        body, url = await self.get(media_url)
+        playlist = parse_media_playlist(body.decode(errors='replace'), url)
+        playlist['media_url'] = media_url
+        return playlist
+
+    def switch(self, index):
+        if not self.variants or self.variants[index]['url'] == self.media_url:
+            return
+        self.media_url = self.variants[index]['url']
+        self.stats['variant_bandwidth'] = self.variants[index]['bandwidth']
+        self.stats['variant_switches'] += 1
+        self.known.clear()
+        self.switched = True
+        self.roll_seq = self.queued_seq + 1 if self.queued_seq is not None else None
+
+    async def poll(self):
+        failures = 0
+        while not (self.closed or self.ended):
+            await asyncio.sleep(max(self.target_duration / 2, 0.5))
+            try:
+                self.schedule(await self.fetch_playlist())
+                failures = 0
+            except Exception as e:
+                failures += 1
+                if failures >= 5:
+                    self.error = IOError(f'Playlist refresh failed: {e}')
+                    self.changed.set()
+                    return
+
+    def schedule(self, playlist):
+        segments = playlist['segments']
+        self.target_duration = playlist['target_duration']
+        if not segments:
+            return
+        if self.next_seq is None:
+            self.next_seq = segments[max(len(segments) - self.live_edge, 0)][0]
+            self.queued_seq = self.next_seq - 1
+        elif self.switched and playlist.get('media_url') == self.media_url:
+            self.switched = False
+            if not segments[0][0] <= self.next_seq <= segments[-1][0] + 1:
+                shift = segments[-1][0] - self.newest - round((time.time() - self.newest_at) / self.target_duration)
+                self.fetching = {seq + shift: task for seq, task in self.fetching.items()}
+                self.next_seq += shift
+                self.queued_seq += shift
+                if self.roll_seq is not None:
+                    self.roll_seq += shift
+
+        newest = self.newest = segments[-1][0]
+        self.newest_at = time.time()
+        for seq, url, duration in segments:
+            if seq > self.queued_seq and seq not in self.known:
+                self.known[seq] = url
+
+        if newest - self.next_seq + 1 > self.live_edge + self.prefetch_depth:
+            skip_to = newest - self.live_edge + 1
+            for seq in range(self.next_seq, skip_to):
+                self.known.pop(seq, None)
+                task = self.fetching.pop(seq, None)
+                if task:
+                    task.cancel()
+            self.stats['dropped'] += skip_to - self.next_seq
+            self.next_seq = skip_to
+            self.queued_seq = max(self.queued_seq, skip_to - 1)
+
+        self.stats['lag_seconds'] = (newest - self.next_seq + 1) * self.target_duration
+        if playlist['ended']:
+            self.ended = True
+            self.last_seq = newest
+        self.fill()
+        self.changed.set()
+
+    def fill(self):
+        for seq in sorted(self.known):
+            if seq >= self.next_seq + self.prefetch_depth:
+                break
+            url = self.known.pop(seq)
+            if seq <= self.queued_seq:
+                continue
+            self.queued_seq = seq
+            self.fetching[seq] = asyncio.create_task(self.fetch_segment(url))
+
+    async def fetch_segment(self, url):
+        for attempt in range(2):
+            if self.closed:
+                return None
+            start = time.time()
+            try:
+                data, final_url = await self.get(url)
+                self.stats['fetch_latency'] += 0.2 * (time.time() - start - self.stats['fetch_latency'])
+                return data
+            except Exception:
+                continue
+        return None
+
+    async def read(self):
+        while not self.closed:
+            if self.error:
+                raise self.error
+            seq = self.next_seq
+            task = self.fetching.get(seq)
+            if task is None:
+                if self.ended and seq is not None and seq > self.last_seq:
+                    return b''
+                if time.time() - self.last_progress > self.stall_timeout:
+                    raise IOError('HLS stream stalled')
+                self.changed.clear()
+                try:
+                    await asyncio.wait_for(self.changed.wait(), 1)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await asyncio.wait({task})
+            if self.next_seq != seq or self.fetching.get(seq) is not task:
+                continue
+            data = None if task.cancelled() else task.result()
+            self.fetching.pop(seq, None)
+            if self.roll_seq is not None and seq >= self.roll_seq:
+                self.roll_seq = None
+                self.rolled = True
+            self.next_seq += 1
+            self.last_progress = time.time()
+            self.fill()
+            if data is None:
+                self.stats['dropped'] += 1
+                continue
+            self.stats['segments'] += 1
+            return data
+        return b''
+
+    def close(self):
+        self.closed = True
+        self.changed.set()
+        if self.poller:
+            self.poller.cancel()
+        for task in self.fetching.values():
+            task.cancel()
+        self.fetching.clear()
+
+
+class RecorderPool:
+    def __init__(self, workers=2, disk_threads=4, blocking_threads=16, resume_threads=32, connections=0):
+        self.workers = max(workers, 1)
+        self.connections = connections
+        self.loops = []
+        self.sessions = {}
+        self.load = []
+        self.lock = threading.Lock()
+        self.disk = ThreadPoolExecutor(max_workers=max(disk_threads, 1), thread_name_prefix='recorder-disk')
+        self.blocking = ThreadPoolExecutor(max_workers=max(blocking_threads, 1), thread_name_prefix='recorder-open')
+        self.resuming = ThreadPoolExecutor(max_workers=max(resume_threads, 1), thread_name_prefix='recorder-resume')
+        self.stats = {'started': 0, 'finished': 0, 'failed': 0}
+        for index in range(self.workers):
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name=f'recorder-loop-{index}', daemon=True).start()
+            self.loops.append(loop)
+            self.load.append(0)
+
+    def session(self):
+        loop = asyncio.get_running_loop()
+        session = self.sessions.get(loop)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(limit=self.connections, ttl_dns_cache=300, keepalive_timeout=60)
+            session = aiohttp.ClientSession(connector=connector)
+            self.sessions[loop] = session
+        return session
+
+    def submit(self, coroutine, on_done=None):
+        with self.lock:
+            index = min(range(self.workers), key=self.load.__getitem__)
+            self.load[index] += 1
+            self.stats['started'] += 1
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.loops[index])
+
+        def finished(future):
+            with self.lock:
+                self.load[index] -= 1
+                self.stats['finished'] += 1
+                if not future.cancelled() and future.exception():
+                    self.stats['failed'] += 1
+            if on_done:
+                on_done(future)
+
+        future.add_done_callback(finished)
+        return future
+
+    async def write(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.disk, function, *args)
+
+    async def call(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.blocking, function, *args)
+
+    async def reconnect(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.resuming, function, *args)
+
+    def status(self):
+        with self.lock:
+            return dict(self.stats, workers=self.workers, streams=list(self.load))
@@ -0,0 +1,134 @@
+import threading
+import time
+from sessionPool import DIRECT, route_key
+
+
+class GeoBlocked(Exception):
+    pass
+
+
+class RouteCache:
+    def __init__(self, ttl=600, negative_ttl=15, region_of=None):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.region_of = region_of
+        self.lock = threading.Lock()
+        self.routes = {}
+        self.denied = {}
+        self.working = {}
+        self.negatives = {}
+        self.stats = {'hits': 0, 'misses': 0, 'negative_hits': 0, 'skipped_routes': 0, 'denials': 0, 'entries': 0}
+
+    def region(self, proxy):
+        if proxy and self.region_of:
+            return self.region_of(proxy)
+        return ''
+
+    def lookup(self, model, kind='api'):
+        with self.lock:
+            entry = self.routes.get((model, kind))
+            if entry and entry[1] > time.time():
+                self.stats['hits'] += 1
+                return True, entry[0]
+            self.routes.pop((model, kind), None)
+            self.stats['misses'] += 1
+            return False, None
+
+    def negative(self, model):
+        with self.lock:
+            entry = self.negatives.get(model)
+            if entry and entry[1] > time.time():
+                self.stats['negative_hits'] += 1
+                return entry[0]
+            self.negatives.pop(model, None)
+            return None
+
+    def is_denied(self, model, proxy=None):
+        region = self.region(proxy)
+        with self.lock:
+            denied = self.denied.get(model, {})
+            now = time.time()
+            if denied.get(route_key(proxy), 0) > now or (region and denied.get(f'region:{region}', 0) > now):
+                self.stats['skipped_routes'] += 1
+                return True
+            return False
+
+    def regions(self, model):
+        now = time.time()
+        with self.lock:
+            prefer = {region for region, expires in self.working.get(model, {}).items() if expires > now}
+            avoid = {key[7:] for key, expires in self.denied.get(model, {}).items() if key.startswith('region:') and expires > now}
+        return prefer, avoid
+
+    def remember(self, model, proxy=None, kind='api'):
+        region = self.region(proxy)
+        with self.lock:
+            self.routes[(model, kind)] = (proxy, time.time() + self.ttl)
+            if kind != 'api':
+                return
+            self.negatives.pop(model, None)
+            routes = self.denied.get(model)
+            if routes:
+                routes.pop(route_key(proxy), None)
+            if region:
+                self.working.setdefault(model, {})[region] = time.time() + self.ttl
+                if routes:
+                    routes.pop(f'region:{region}', None)
+
+    def offline(self, model, proxy=None):
+        self.remember(model, proxy)
+        with self.lock:
+            self.negatives[model] = ('offline', time.time() + self.negative_ttl)
+
+    def deny(self, model, proxy=None):
+        key = route_key(proxy)
+        region = self.region(proxy)
+        with self.lock:
+            self.stats['denials'] += 1
+            denied = self.denied.setdefault(model, {})
+            denied[key] = time.time() + self.ttl
+            if region:
+                denied[f'region:{region}'] = denied[key]
+                self.working.get(model, {}).pop(region, None)
+            entry = self.routes.get((model, 'api'))
+            if entry and route_key(entry[0]) == key:
+                del self.routes[(model, 'api')]
+
+    def unreachable(self, model):
+        with self.lock:
+            self.negatives[model] = ('denied', time.time() + self.negative_ttl)
+
+    def forget(self, model, proxy=None, kind='api'):
+        with self.lock:
+            entry = self.routes.get((model, kind))
+            if entry and route_key(entry[0]) == route_key(proxy):
+                del self.routes[(model, kind)]
+
+    def discard(self, model):
+        with self.lock:
+            self.routes.pop((model, 'api'), None)
+            self.routes.pop((model, 'stream'), None)
+            self.denied.pop(model, None)
+            self.working.pop(model, None)
+            self.negatives.pop(model, None)
+
+    def prune(self):
+        now = time.time()
+        with self.lock:
+            for cache in (self.routes, self.negatives):
+                for key in [key for key, entry in cache.items() if entry[1] <= now]:
+                    del cache[key]
+            for cache in (self.denied, self.working):
+                for model in list(cache):
+                    routes = {key: expires for key, expires in cache[model].items() if expires > now}
+                    if routes:
+                        cache[model] = routes
+                    else:
+                        del cache[model]
+
+    def status(self):
+        with self.lock:
+            self.stats['entries'] = len(self.routes)
+            status = dict(self.stats)
+            status['denied_direct'] = sum(1 for routes in self.denied.values() if DIRECT in routes)
+        return status
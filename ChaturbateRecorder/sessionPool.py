@@ -0,0 +1,105 @@
+import threading
+import time
+from collections import OrderedDict
+import requests
+import streamlink
+from requests.adapters import HTTPAdapter
+from metricsServer import Histogram
+
+DIRECT = 'direct'
+
+
+def route_key(proxy):
+    if not proxy:
+        return DIRECT
+    if isinstance(proxy, dict):
+        return proxy.get('https') or proxy.get('http') or DIRECT
+    return proxy
+
+
+class Route:
+    def __init__(self, key, adapter):
+        self.key = key
+        self.adapter = adapter
+        self.lock = threading.Lock()
+        self.http = requests.Session()
+        self.http.mount('http://', adapter)
+        self.http.mount('https://', adapter)
+        if key != DIRECT:
+            self.http.proxies = {'http': key, 'https': key}
+        self.streamlink = None
+
+    def close(self):
+        self.http.close()
+        if self.streamlink:
+            self.streamlink.http.close()
+        self.adapter.close()
+
+
+class SessionPool:
+    def __init__(self, pool_size=32, max_routes=64, stream_timeout=30):
+        self.pool_size = pool_size
+        self.max_routes = max(max_routes, 1)
+        self.stream_timeout = stream_timeout
+        self.lock = threading.Lock()
+        self.routes = OrderedDict()
+        self.ttfb = Histogram()
+        self.stats = {
+            'routes': 0,
+            'sessions_created': 0,
+            'session_reuses': 0,
+            'streamlink_sessions': 0,
+            'evicted': 0,
+            'setup_cpu_seconds': 0.0,
+        }
+
+    def route(self, proxy=None):
+        key = route_key(proxy)
+        evicted = []
+        with self.lock:
+            route = self.routes.get(key)
+            if route:
+                self.routes.move_to_end(key)
+                self.stats['session_reuses'] += 1
+                return route
+            start = time.thread_time()
+            route = Route(key, HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size))
+            self.routes[key] = route
+            while len(self.routes) > self.max_routes:
+                oldest = next(name for name in self.routes if name != DIRECT)
+                evicted.append(self.routes.pop(oldest))
+                self.stats['evicted'] += 1
+            self.stats['routes'] = len(self.routes)
+            self.stats['sessions_created'] += 1
+            self.stats['setup_cpu_seconds'] += time.thread_time() - start
+        for old in evicted:
+            old.close()
+        return route
+
+    def http(self, proxy=None):
+        return self.route(proxy).http
+
+    def streamlink_session(self, proxy=None):
+        route = self.route(proxy)
+        with route.lock:
+            if route.streamlink is None:
+                start = time.thread_time()
+                session = streamlink.Streamlink()
+                session.set_option('stream-timeout', self.stream_timeout)
+                if route.key != DIRECT:
+                    session.set_option('http-proxy', route.key)
+                session.http.mount('http://', route.adapter)
+                session.http.mount('https://', route.adapter)
+                route.streamlink = session
+                with self.lock:
+                    self.stats['streamlink_sessions'] += 1
+                    self.stats['setup_cpu_seconds'] += time.thread_time() - start
+            return route.streamlink
+
+    def observe_ttfb(self, seconds):
+        with self.lock:
+            self.ttfb.observe(seconds)
+
+    def status(self):
+        with self.lock:
+            return dict(self.stats, ttfb=self.ttfb.snapshot())
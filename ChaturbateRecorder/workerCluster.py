@@ -0,0 +1,272 @@
+import bisect
+import hashlib
+import json
+import os
+import socket
+import subprocess
+import threading
+import time
+import uuid
+from logWriter import log
+
+
+def ring_hash(key):
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    def __init__(self, nodes, vnodes=64):
+        self.nodes = sorted(nodes)
+        points = sorted((ring_hash(f'{node}#{index}'), node) for node in self.nodes for index in range(vnodes))
+        self.keys = [point for point, node in points]
+        self.owners = [node for point, node in points]
+
+    def owner(self, key):
+        if not self.keys:
+            return None
+        return self.owners[bisect.bisect(self.keys, ring_hash(key)) % len(self.keys)]
+
+
+def write_json(path, data):
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f, default=str, separators=(',', ':'))
+    os.replace(tmp, path)
+
+
+def read_heartbeats(directory):
+    heartbeats = []
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return heartbeats
+    for name in names:
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(directory, name)) as f:
+                heartbeats.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return heartbeats
+
+
+class ClusterMember(threading.Thread):
+    def __init__(self, directory, worker_id, lease_timeout=30, interval=5, status=None, on_lost=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.worker_id = worker_id
+        self.lease_timeout = lease_timeout
+        self.interval = interval
+        self.status = status
+        self.on_lost = on_lost
+        self.heartbeat_dir = os.path.join(directory, 'workers')
+        self.lease_dir = os.path.join(directory, 'leases')
+        os.makedirs(self.heartbeat_dir, exist_ok=True)
+        os.makedirs(self.lease_dir, exist_ok=True)
+        self.heartbeat_file = os.path.join(self.heartbeat_dir, f'{worker_id}.json')
+        self.token = f'{worker_id}:{socket.gethostname()}:{os.getpid()}'
+        self.held = set()
+        self.leaving = False
+        self.lock = threading.Lock()
+        self.workers = [worker_id]
+        self.ring = HashRing(self.workers)
+        self.stats = {'workers': 1, 'leases': 0, 'busy': 0, 'taken_over': 0, 'lost': 0}
+
+    def owns(self, model):
+        return self.ring.owner(model) == self.worker_id
+
+    def lease_path(self, model):
+        return os.path.join(self.lease_dir, f'{model}.lease')
+
+    def acquire(self, model):
+        path = self.lease_path(model)
+        for attempt in range(2):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                if attempt or not self.expire(path):
+                    self.stats['busy'] += 1
+                    return False
+                continue
+            with os.fdopen(fd, 'w') as f:
+                f.write(self.token)
+            with self.lock:
+                self.held.add(model)
+                self.stats['leases'] = len(self.held)
+            return True
+        return False
+
+    def expire(self, path):
+        try:
+            if time.time() - os.stat(path).st_mtime < self.lease_timeout:
+                return False
+            stale = f'{path}.{uuid.uuid4().hex}.stale'
+            os.rename(path, stale)
+            if time.time() - os.stat(stale).st_mtime < self.lease_timeout:
+                try:
+                    os.link(stale, path)
+                except OSError:
+                    pass
+                os.remove(stale)
+                return False
+            os.remove(stale)
+        except FileNotFoundError:
+            pass
+        self.stats['taken_over'] += 1
+        log('recorder', f'Took over the expired lease {os.path.basename(path)}')
+        return True
+
+    def holder(self, model):
+        try:
+            with open(self.lease_path(model)) as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def release(self, model):
+        with self.lock:
+            if model not in self.held:
+                return
+            self.held.discard(model)
+            self.stats['leases'] = len(self.held)
+        if self.holder(model) == self.token:
+            try:
+                os.remove(self.lease_path(model))
+            except OSError:
+                pass
+
+    def renew(self):
+        now = time.time()
+        with self.lock:
+            held = list(self.held)
+        for model in held:
+            if self.holder(model) == self.token:
+                try:
+                    os.utime(self.lease_path(model), (now, now))
+                    continue
+                except OSError:
+                    pass
+            with self.lock:
+                self.held.discard(model)
+                self.stats['leases'] = len(self.held)
+            self.stats['lost'] += 1
+            log('recorder', f'[{model}] Lease lost to another worker, stopping this recording', 'warning')
+            if self.on_lost:
+                self.on_lost(model)
+
+    def beat(self):
+        now = time.time()
+        write_json(self.heartbeat_file, {
+            'id': self.worker_id,
+            'host': socket.gethostname(),
+            'pid': os.getpid(),
+            'time': now,
+            'status': self.status() if self.status else None,
+            })
+        alive = {self.worker_id}
+        for heartbeat in read_heartbeats(self.heartbeat_dir):
+            if now - heartbeat.get('time', 0) < self.lease_timeout:
+                alive.add(heartbeat['id'])
+        workers = sorted(alive)
+        if workers != self.workers:
+            log('recorder', f'Cluster membership changed: {len(self.workers)} -> {len(workers)} workers ({", ".join(workers)})')
+            self.workers = workers
+            self.ring = HashRing(workers)
+            self.stats['workers'] = len(workers)
+
+    def run(self):
+        while True:
+            try:
+                self.renew()
+                if not self.leaving:
+                    self.beat()
+            except Exception as e:
+                log('recorder', f'Cluster heartbeat failed: {e}', 'error')
+            time.sleep(self.interval)
+
+    def leave(self):
+        self.leaving = True
+        try:
+            os.remove(self.heartbeat_file)
+        except OSError:
+            pass
+
+
+def merge_numbers(target, source):
+    for key, value in source.items():
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        if key.startswith(('last_', 'avg_')) and key.endswith('_seconds'):
+            target[key] = max(target.get(key, 0), value)
+        else:
+            target[key] = target.get(key, 0) + value
+
+
+class Coordinator(threading.Thread):
+    def __init__(self, directory, lease_timeout=30, command=None, workers=0):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.heartbeat_dir = os.path.join(directory, 'workers')
+        os.makedirs(self.heartbeat_dir, exist_ok=True)
+        self.lease_timeout = lease_timeout
+        self.command = command
+        self.processes = {f'{socket.gethostname()}-{index}': None for index in range(workers)}
+        self.restarts = 0
+
+    def spawn(self, worker_id):
+        self.processes[worker_id] = subprocess.Popen(self.command + ['--worker', worker_id], stdout=subprocess.DEVNULL)
+
+    def run(self):
+        for worker_id in self.processes:
+            self.spawn(worker_id)
+        while True:
+            time.sleep(5)
+            for worker_id, process in self.processes.items():
+                if process.poll() is not None:
+                    log('recorder', f'Worker {worker_id} exited with code {process.returncode}, restarting', 'warning')
+                    self.restarts += 1
+                    self.spawn(worker_id)
+
+    def stop(self):
+        for process in self.processes.values():
+            if process and process.poll() is None:
+                process.terminate()
+        for process in self.processes.values():
+            if process:
+                try:
+                    process.wait(30)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+
+    def status(self):
+        now = time.time()
+        merged = {'time': now, 'wanted': 0, 'states': {}, 'starting': [], 'recordings': [], 'prober': {}, 'schedule': {},
+                  'proxy': {}, 'sessions': {}, 'routes': {}, 'recorder': {}, 'bandwidth': {}, 'postprocessing': {'queue_depth': 0}, 'disk': {}, 'workers': [], 'restarts': self.restarts}
+        for heartbeat in sorted(read_heartbeats(self.heartbeat_dir), key=lambda h: h.get('id', '')):
+            age = now - heartbeat.get('time', 0)
+            status = heartbeat.get('status') or {}
+            alive = age < self.lease_timeout
+            merged['workers'].append({
+                'id': heartbeat.get('id'),
+                'host': heartbeat.get('host'),
+                'pid': heartbeat.get('pid'),
+                'age': round(age, 1),
+                'alive': alive,
+                'recordings': len(status.get('recordings', [])),
+                })
+            if not alive:
+                continue
+            merged['wanted'] = max(merged['wanted'], status.get('wanted', 0))
+            merged['starting'].extend(status.get('starting', []))
+            for recording in status.get('recordings', []):
+                recording['worker'] = heartbeat.get('id')
+                merged['recordings'].append(recording)
+            for section in ('states', 'prober', 'schedule', 'proxy', 'sessions', 'routes', 'recorder', 'bandwidth', 'postprocessing'):
+                merge_numbers(merged[section], status.get(section, {}))
+            disk = status.get('disk', {})
+            merge_numbers(merged['disk'], {key: value for key, value in disk.items() if key != 'free'})
+            if disk.get('free') is not None:
+                merged['disk']['free'] = min(merged['disk'].get('free', disk['free']), disk['free'])
+            merged['disk']['paused'] = merged['disk'].get('paused', False) or disk.get('paused', False)
+        return merged